@@ -6,37 +6,949 @@
 #    /chat_with_agent
 # ============================================================
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from openai import OpenAI
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from itertools import combinations, count
+import numpy as np
+import atexit
+import cProfile
+import fcntl
+import hashlib
+import io
+import json
+import math
+import os
+import pstats
 import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
 
 app = Flask(__name__)
-CORS(app)
 
-client = OpenAI()
+# 允许带 cookie 跨域访问的前端，逗号分隔，如 "https://game.example.com"。
+# 未设置时任何来源都能调用，但不带凭据（跨域前端拿不到自己的局，退回默认局）
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "").split(",") if o.strip()]
+if CORS_ORIGINS:
+    CORS(app, origins=CORS_ORIGINS, supports_credentials=True)
+else:
+    CORS(app)
 
 # ============================================================
 # GLOBALS
 # ============================================================
 
-MAX_ROUNDS = 10
+MAX_ROUNDS = int(os.environ.get("MAX_ROUNDS", "10"))
 
-# payoff matrices (占位)
-AM_PAYOFFS = [ [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 21.0, 22.0, 23.0, 24.0, 25.0], [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0], [-1.0, 19.0, 29.0, 38.0, 45.0, 51.0, 57.0, 62.0, 66.0, 70.0, 74.0, 77.0, 80.0, 83.0, 86.0, 88.0, 91.0, 93.0, 95.0, 97.0, 99.0, 100.0, 102.0, 103.0, 105.0, 106.0], [-3.0, 27.0, 42.0, 55.0, 66.0, 76.0, 84.0, 92.0, 99.0, 105.0, 111.0, 117.0, 122.0, 127.0, 131.0, 136.0, 140.0, 144.0, 148.0, 151.0, 154.0, 158.0, 161.0, 164.0, 166.0, 169.0], [-7.0, 31.0, 51.0, 68.0, 82.0, 95.0, 107.0, 117.0, 126.0, 135.0, 143.0, 151.0, 158.0, 165.0, 171.0, 177.0, 183.0, 189.0, 194.0, 199.0, 204.0, 209.0, 213.0, 217.0, 221.0, 225.0], [-12.0, 33.0, 57.0, 77.0, 95.0, 110.0, 124.0, 137.0, 148.0, 159.0, 169.0, 179.0, 188.0, 196.0, 204.0, 212.0, 220.0, 227.0, 234.0, 240.0, 247.0, 253.0, 259.0, 264.0, 270.0, 275.0], [-18.0, 33.0, 61.0, 84.0, 104.0, 122.0, 138.0, 153.0, 166.0, 179.0, 191.0, 202.0, 213.0, 223.0, 233.0, 242.0, 251.0, 260.0, 268.0, 276.0, 284.0, 292.0, 299.0, 306.0, 313.0, 320.0], [-25.0, 32.0, 63.0, 88.0, 111.0, 131.0, 149.0, 166.0, 182.0, 196.0, 210.0, 223.0, 236.0, 248.0, 259.0, 270.0, 281.0, 291.0, 301.0, 311.0, 320.0, 329.0, 338.0, 347.0, 355.0, 363.0], [-33.0, 30.0, 63.0, 91.0, 116.0, 138.0, 158.0, 177.0, 194.0, 211.0, 226.0, 241.0, 255.0, 269.0, 282.0, 295.0, 307.0, 319.0, 330.0, 342.0, 352.0, 363.0, 373.0, 383.0, 393.0, 402.0], [-42.0, 27.0, 63.0, 93.0, 119.0, 143.0, 165.0, 186.0, 205.0, 223.0, 240.0, 256.0, 272.0, 287.0, 302.0, 316.0, 330.0, 343.0, 356.0, 369.0, 381.0, 393.0, 405.0, 416.0, 427.0, 438.0], [-52.0, 23.0, 62.0, 94.0, 122.0, 147.0, 171.0, 193.0, 214.0, 233.0, 252.0, 270.0, 287.0, 304.0, 320.0, 336.0, 351.0, 366.0, 380.0, 394.0, 408.0, 421.0, 434.0, 447.0, 459.0, 472.0], [-63.0, 18.0, 60.0, 94.0, 124.0, 151.0, 176.0, 199.0, 222.0, 243.0, 263.0, 283.0, 302.0, 320.0, 338.0, 355.0, 371.0, 388.0, 403.0, 419.0, 434.0, 449.0, 463.0, 477.0, 491.0, 505.0], [-75.0, 12.0, 58.0, 94.0, 125.0, 154.0, 180.0, 205.0, 229.0, 251.0, 273.0, 294.0, 315.0, 335.0, 354.0, 373.0, 391.0, 409.0, 426.0, 443.0, 460.0, 476.0, 492.0, 508.0, 523.0, 538.0], [-88.0, 6.0, 55.0, 93.0, 126.0, 156.0, 184.0, 211.0, 236.0, 260.0, 283.0, 305.0, 327.0, 349.0, 370.0, 390.0, 410.0, 430.0, 449.0, 467.0, 486.0, 504.0, 521.0, 539.0, 556.0, 572.0], [-102.0, -1.0, 52.0, 91.0, 126.0, 158.0, 188.0, 216.0, 242.0, 268.0, 292.0, 316.0, 339.0, 362.0, 384.0, 406.0, 427.0, 448.0, 469.0, 489.0, 509.0, 528.0, 548.0, 566.0, 585.0, 603.0], [-117.0, -9.0, 48.0, 89.0, 125.0, 159.0, 191.0, 220.0, 249.0, 276.0, 302.0, 327.0, 352.0, 376.0, 399.0, 422.0, 445.0, 467.0, 489.0, 511.0, 532.0, 553.0, 574.0, 594.0, 614.0, 634.0], [-133.0, -17.0, 44.0, 87.0, 125.0, 160.0, 193.0, 225.0, 255.0, 283.0, 311.0, 338.0, 364.0, 390.0, 415.0, 440.0, 464.0, 488.0, 511.0, 534.0, 557.0, 579.0, 601.0, 623.0, 645.0, 666.0], [-150.0, -26.0, 39.0, 85.0, 124.0, 161.0, 196.0, 229.0, 260.0, 291.0, 320.0, 349.0, 377.0, 404.0, 431.0, 457.0, 483.0, 508.0, 533.0, 558.0, 582.0, 606.0, 630.0, 653.0, 676.0, 699.0], [-168.0, -36.0, 35.0, 82.0, 123.0, 161.0, 198.0, 233.0, 266.0, 298.0, 329.0, 359.0, 389.0, 418.0, 446.0, 474.0, 501.0, 528.0, 554.0, 581.0, 606.0, 632.0, 657.0, 682.0, 707.0, 731.0], [-187.0, -46.0, 30.0, 80.0, 122.0, 162.0, 199.0, 236.0, 271.0, 305.0, 338.0, 370.0, 401.0, 432.0, 462.0, 491.0, 520.0, 549.0, 577.0, 605.0, 632.0, 659.0, 686.0, 712.0, 738.0, 764.0], [-207.0, -57.0, 25.0, 77.0, 121.0, 162.0, 201.0, 239.0, 275.0, 311.0, 345.0, 379.0, 412.0, 444.0, 476.0, 508.0, 538.0, 569.0, 599.0, 628.0, 657.0, 686.0, 714.0, 742.0, 770.0, 797.0], [-228.0, -68.0, 19.0, 74.0, 119.0, 162.0, 203.0, 242.0, 280.0, 317.0, 353.0, 388.0, 423.0, 457.0, 490.0, 523.0, 556.0, 588.0, 620.0, 651.0, 682.0, 713.0, 743.0, 773.0, 802.0, 832.0], [-250.0, -80.0, 14.0, 71.0, 118.0, 162.0, 204.0, 245.0, 284.0, 323.0, 360.0, 397.0, 434.0, 469.0, 505.0, 539.0, 574.0, 608.0, 641.0, 675.0, 707.0, 740.0, 772.0, 804.0, 835.0, 867.0], [-273.0, -93.0, 8.0, 68.0, 117.0, 162.0, 205.0, 248.0, 289.0, 329.0, 368.0, 407.0, 445.0, 482.0, 519.0, 555.0, 591.0, 627.0, 662.0, 697.0, 732.0, 766.0, 800.0, 834.0, 868.0, 901.0], [-297.0, -106.0, 2.0, 65.0, 115.0, 162.0, 207.0, 250.0, 293.0, 334.0, 375.0, 415.0, 455.0, 494.0, 533.0, 571.0, 609.0, 646.0, 684.0, 720.0, 757.0, 793.0, 829.0, 865.0, 900.0, 936.0], [-322.0, -120.0, -4.0, 61.0, 114.0, 163.0, 209.0, 253.0, 297.0, 340.0, 382.0, 424.0, 465.0, 506.0, 546.0, 586.0, 626.0, 665.0, 704.0, 743.0, 781.0, 819.0, 857.0, 895.0, 932.0, 970.0] ] 
-# NOTE: Row 0 is header. Col 0 is header. Data starts at Row 1, Col 1.
+# 每轮从收到请求到给出结果的最长等待（秒），超时则 advisor 退回 balanced_strategy
+ROUND_DEADLINE = float(os.environ.get("ROUND_DEADLINE", "8"))
 
-MC_PAYOFFS = [ [None, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0, 17.0, 18.0, 19.0, 20.0, 21.0, 22.0, 23.0, 24.0], [0.0, 0.0, -1.0, -4.0, -9.0, -16.0, -25.0, -36.0, -49.0, -64.0, -81.0, -100.0, -121.0, -144.0, -169.0, -196.0, -225.0, -256.0, -289.0, -324.0, -361.0, -400.0, -441.0, -484.0, -529.0, -576.0], [1.0, 0.0, 19.0, 26.0, 30.0, 32.0, 32.0, 30.0, 26.0, 20.0, 12.0, 2.0, -10.0, -24.0, -40.0, -58.0, -78.0, -100.0, -124.0, -150.0, -178.0, -208.0, -240.0, -274.0, -310.0, -348.0], [2.0, 0.0, 29.0, 42.0, 50.0, 55.0, 58.0, 59.0, 58.0, 55.0, 50.0, 43.0, 34.0, 23.0, 10.0, -5.0, -22.0, -41.0, -62.0, -85.0, -110.0, -137.0, -166.0, -197.0, -230.0, -265.0], [3.0, 0.0, 38.0, 55.0, 66.0, 74.0, 79.0, 82.0, 83.0, 82.0, 79.0, 74.0, 67.0, 58.0, 47.0, 34.0, 19.0, 2.0, -17.0, -38.0, -61.0, -86.0, -113.0, -142.0, -173.0, -206.0], [4.0, 0.0, 45.0, 66.0, 82.0, 91.0, 98.0, 103.0, 106.0, 107.0, 106.0, 103.0, 98.0, 91.0, 82.0, 71.0, 58.0, 43.0, 26.0, 7.0, -14.0, -37.0, -62.0, -89.0, -118.0, -149.0], [5.0, 0.0, 51.0, 76.0, 95.0, 107.0, 116.0, 122.0, 126.0, 128.0, 128.0, 126.0, 122.0, 116.0, 108.0, 98.0, 86.0, 72.0, 56.0, 38.0, 18.0, -4.0, -28.0, -54.0, -82.0, -112.0], [6.0, 0.0, 57.0, 84.0, 107.0, 122.0, 133.0, 141.0, 146.0, 149.0, 150.0, 149.0, 146.0, 141.0, 134.0, 125.0, 114.0, 101.0, 86.0, 69.0, 50.0, 29.0, 6.0, -19.0, -46.0, -75.0], [7.0, 0.0, 62.0, 92.0, 117.0, 136.0, 149.0, 159.0, 166.0, 170.0, 172.0, 172.0, 170.0, 166.0, 160.0, 152.0, 142.0, 130.0, 116.0, 100.0, 82.0, 62.0, 40.0, 16.0, -10.0, -38.0], [8.0, 0.0, 66.0, 99.0, 126.0, 148.0, 164.0, 177.0, 186.0, 192.0, 196.0, 197.0, 196.0, 193.0, 188.0, 181.0, 172.0, 161.0, 148.0, 133.0, 116.0, 97.0, 76.0, 53.0, 28.0, 1.0], [9.0, 0.0, 70.0, 105.0, 135.0, 159.0, 179.0, 194.0, 205.0, 213.0, 218.0, 221.0, 221.0, 219.0, 215.0, 209.0, 201.0, 191.0, 179.0, 165.0, 149.0, 131.0, 111.0, 89.0, 65.0, 39.0], [10.0, 0.0, 74.0, 111.0, 143.0, 169.0, 191.0, 208.0, 222.0, 232.0, 239.0, 243.0, 245.0, 244.0, 241.0, 236.0, 229.0, 220.0, 209.0, 196.0, 181.0, 164.0, 145.0, 124.0, 101.0, 76.0], [11.0, 0.0, 77.0, 117.0, 151.0, 179.0, 202.0, 222.0, 237.0, 249.0, 258.0, 264.0, 267.0, 268.0, 266.0, 262.0, 256.0, 248.0, 238.0, 226.0, 212.0, 196.0, 178.0, 158.0, 136.0, 112.0], [12.0, 0.0, 80.0, 122.0, 158.0, 188.0, 213.0, 234.0, 251.0, 265.0, 275.0, 283.0, 288.0, 290.0, 290.0, 287.0, 282.0, 275.0, 266.0, 255.0, 242.0, 227.0, 210.0, 191.0, 170.0, 147.0], [13.0, 0.0, 83.0, 127.0, 165.0, 196.0, 223.0, 245.0, 264.0, 279.0, 291.0, 300.0, 307.0, 311.0, 312.0, 311.0, 307.0, 301.0, 293.0, 283.0, 271.0, 257.0, 241.0, 223.0, 203.0, 181.0], [14.0, 0.0, 86.0, 131.0, 171.0, 204.0, 232.0, 256.0, 276.0, 293.0, 306.0, 317.0, 325.0, 330.0, 333.0, 333.0, 331.0, 326.0, 319.0, 310.0, 299.0, 286.0, 271.0, 254.0, 235.0, 214.0], [15.0, 0.0, 88.0, 136.0, 177.0, 212.0, 242.0, 267.0, 288.0, 306.0, 321.0, 333.0, 342.0, 349.0, 353.0, 355.0, 354.0, 351.0, 345.0, 337.0, 327.0, 315.0, 301.0, 285.0, 267.0, 247.0], [16.0, 0.0, 91.0, 140.0, 183.0, 220.0, 251.0, 278.0, 301.0, 320.0, 336.0, 349.0, 359.0, 367.0, 372.0, 375.0, 376.0, 374.0, 370.0, 364.0, 355.0, 344.0, 331.0, 316.0, 299.0, 280.0], [17.0, 0.0, 93.0, 144.0, 189.0, 227.0, 260.0, 288.0, 312.0, 333.0, 350.0, 364.0, 376.0, 385.0, 391.0, 395.0, 397.0, 396.0, 393.0, 388.0, 381.0, 372.0, 360.0, 346.0, 330.0, 312.0], [18.0, 0.0, 95.0, 148.0, 194.0, 234.0, 268.0, 298.0, 323.0, 345.0, 364.0, 379.0, 392.0, 402.0, 410.0, 415.0, 418.0, 418.0, 416.0, 412.0, 406.0, 398.0, 388.0, 376.0, 361.0, 344.0], [19.0, 0.0, 97.0, 151.0, 199.0, 240.0, 276.0, 308.0, 335.0, 358.0, 378.0, 394.0, 408.0, 419.0, 428.0, 434.0, 438.0, 440.0, 439.0, 436.0, 431.0, 424.0, 415.0, 404.0, 391.0, 375.0], [20.0, 0.0, 99.0, 154.0, 204.0, 247.0, 284.0, 317.0, 346.0, 370.0, 391.0, 409.0, 424.0, 436.0, 446.0, 453.0, 458.0, 461.0, 461.0, 459.0, 455.0, 449.0, 441.0, 431.0, 419.0, 405.0], [21.0, 0.0, 100.0, 158.0, 209.0, 253.0, 292.0, 326.0, 356.0, 382.0, 404.0, 423.0, 439.0, 452.0, 463.0, 471.0, 477.0, 481.0, 482.0, 481.0, 478.0, 473.0, 466.0, 457.0, 446.0, 433.0], [22.0, 0.0, 102.0, 161.0, 213.0, 259.0, 299.0, 335.0, 366.0, 393.0, 417.0, 437.0, 454.0, 468.0, 480.0, 489.0, 496.0, 501.0, 503.0, 503.0, 501.0, 497.0, 491.0, 483.0, 473.0, 461.0], [23.0, 0.0, 103.0, 164.0, 217.0, 264.0, 306.0, 343.0, 376.0, 405.0, 430.0, 451.0, 469.0, 484.0, 497.0, 507.0, 515.0, 520.0, 523.0, 524.0, 523.0, 520.0, 515.0, 508.0, 499.0, 488.0], [24.0, 0.0, 105.0, 166.0, 221.0, 270.0, 313.0, 351.0, 385.0, 415.0, 441.0, 464.0, 483.0, 500.0, 513.0, 524.0, 533.0, 539.0, 543.0, 545.0, 545.0, 543.0, 538.0, 532.0, 524.0, 514.0], [25.0, 0.0, 106.0, 169.0, 225.0, 275.0, 320.0, 360.0, 395.0, 426.0, 453.0, 477.0, 497.0, 515.0, 529.0, 541.0, 551.0, 558.0, 563.0, 566.0, 567.0, 565.0, 562.0, 556.0, 548.0, 539.0] ]
 
-# player states
-game_state = {
-    "round": 0,
-    "history": [],
-    "am_total": 0,
-    "mc_total": 0,
-    "last_am": None,
-    "last_mc": None,
-}
+def _gevent_patched():
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+# advisor 并发上限；gevent worker 下这些线程是 greenlet，默认按 worker_connections 开，
+# 每个连接都能有一轮在等 LLM，不会排队排到 deadline
+ADVISOR_WORKERS = int(
+    os.environ.get("ADVISOR_WORKERS")
+    or (os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000") if _gevent_patched() else "64")
+)
+
+LLM_MODEL = "gpt-4o-mini"
+
+# advisor prompt history: "full" = every round verbatim;
+# "rolling" = running stats + only the last PROMPT_RECENT_ROUNDS rounds (constant size)
+PROMPT_HISTORY = os.environ.get("PROMPT_HISTORY", "full")
+PROMPT_RECENT_ROUNDS = int(os.environ.get("PROMPT_RECENT_ROUNDS", "8"))
+MC_TREND_ALPHA = 0.3  # EMA weight of the newest MC move change
+
+# payoff matrices (占位) live in payoff_tables.py; see PAYOFF ENGINE
+
+def new_history_stats():
+    return {
+        "n": 0,
+        "am_mean": 0.0,
+        "am_m2": 0.0,
+        "mc_mean": 0.0,
+        "mc_m2": 0.0,
+        "streak_side": None,  # who out-earned the other in the latest rounds
+        "streak_len": 0,
+        "mc_trend": 0.0,  # EMA of MC's round-to-round change
+    }
+
+
+# player states — one dict per game, kept in `game_store` (see GAME STATE STORE)
+def new_game_state():
+    return {
+        "epoch": uuid.uuid4().hex,  # new per (re)start; guards per-game caches
+        "round": 0,
+        "history": [],
+        "history_text": "",  # advisor prompt lines, appended per round ("full" mode)
+        "stats": new_history_stats(),  # running summary for "rolling" mode
+        "am_total": 0,
+        "mc_total": 0,
+        "last_am": None,
+        "last_mc": None,
+    }
+
+# ============================================================
+# GAME STATE STORE
+# ============================================================
+#  GAME_STORE=memory  -> in-process LRU + TTL (one worker, any number of threads)
+#  GAME_STORE=sqlite  -> shared SQLite file in WAL mode (many workers)
+#  Rounds are committed compare-and-set on (epoch, round): of two requests
+#  racing on the same game one wins, the other gets RoundConflict (409).
+
+GAME_STORE = os.environ.get("GAME_STORE", "memory")
+GAME_STORE_PATH = os.environ.get("GAME_STORE_PATH", "game_state.db")
+GAME_STORE_MAX_GAMES = int(os.environ.get("GAME_STORE_MAX_GAMES", "10000"))
+GAME_STORE_TTL = float(os.environ.get("GAME_STORE_TTL", "86400"))
+
+# 旧前端不传 game_id：/start_simulation 发一个 cookie，每个浏览器各自一局。
+# GAME_COOKIE="" (或客户端不带 cookie) 时才退回共享的默认局
+GAME_COOKIE = os.environ.get("GAME_COOKIE", "b7_game")
+# "None" for a front-end on another site (implies Secure, i.e. HTTPS only;
+# that site must also be listed in CORS_ORIGINS)
+GAME_COOKIE_SAMESITE = os.environ.get("GAME_COOKIE_SAMESITE", "Lax")
+DEFAULT_GAME_ID = "default"
+
+
+class LRUTTLCache:
+    """
+    Thread-safe LRU map with per-entry expiry.
+    Expired entries are dropped lazily on access; the least recently used
+    entry is evicted once `max_size` is exceeded.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        """Unexpired entries; sweeps out the expired ones while counting."""
+        with self._lock:
+            now = time.monotonic()
+            for key in [k for k, (expires_at, _) in self._data.items() if expires_at < now]:
+                del self._data[key]
+            return len(self._data)
+
+
+class RoundConflict(Exception):
+    """A concurrent request committed this game's next round (or restarted it) first."""
+
+
+def working_copy(state):
+    """
+    A copy of `state` that play_round can mutate without touching the
+    stored version: the containers it appends to are copied (O(rounds)
+    pointers), the round entries themselves are shared.
+    """
+    copy = dict(state, history=list(state["history"]))
+    if copy.get("stats") is not None:
+        copy["stats"] = dict(copy["stats"])
+    return copy
+
+
+class MemoryGameStore:
+    """
+    In-process store (one worker, any number of threads). `load` returns a
+    working copy; `commit` installs it only if nobody else committed the
+    game's next round in the meantime.
+    """
+
+    def __init__(self, max_games=GAME_STORE_MAX_GAMES, ttl=GAME_STORE_TTL):
+        self._cache = LRUTTLCache(max_games, ttl)
+        self._lock = threading.Lock()
+
+    def load(self, game_id, since_round=0):
+        """A working copy of the game; the whole history is at hand here, so since_round is moot."""
+        state = self._cache.get(game_id)
+        return working_copy(state) if state is not None else None
+
+    def save(self, game_id, state):
+        """Store `state` unconditionally (new game, restart, replay)."""
+        self._cache.put(game_id, working_copy(state))
+
+    def commit(self, game_id, state, entry):
+        """Store `state` after playing `entry`; RoundConflict if it no longer follows the stored game."""
+        with self._lock:
+            current = self._cache.get(game_id)
+            if current is None:
+                if entry["round"] != 1:
+                    raise RoundConflict(game_id)
+            elif current["epoch"] != state["epoch"] or current["round"] != entry["round"] - 1:
+                raise RoundConflict(game_id)
+            self._cache.put(game_id, working_copy(state))
+
+    def restore(self, game_id, state, last_ts):
+        """
+        Store a replayed `state` unless this process already has the game as
+        far along, or restarted it since (everything here is newer than the
+        log). Returns True if it was stored.
+        """
+        with self._lock:
+            current = self._cache.get(game_id)
+            if current is not None and (current["epoch"] != state["epoch"]
+                                        or current["round"] >= state["round"]):
+                return False
+            self._cache.put(game_id, working_copy(state))
+            return True
+
+    def delete(self, game_id):
+        self._cache.delete(game_id)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def open_sqlite(path):
+    """WAL-mode connection that tolerates other workers holding the write lock."""
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+SQLITE_PURGE_EVERY = 500  # writes between expired-row sweeps
+
+
+class SQLiteConnections:
+    """
+    One open_sqlite connection per thread to `path`. A connection
+    inherited across fork (gunicorn --preload) is never reused; the child
+    opens its own. `wrote()` counts writes and calls `purge` every
+    `purge_every` of them.
+    """
+
+    def __init__(self, path, purge, purge_every=SQLITE_PURGE_EVERY):
+        self.path = path
+        self.purge_every = purge_every
+        self._purge = purge
+        self._local = threading.local()
+        self._writes = count(1)  # next() on it is atomic under the GIL
+
+    def get(self):
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn = open_sqlite(self.path)
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def wrote(self):
+        if next(self._writes) % self.purge_every == 0:
+            self._purge()
+
+
+class SQLiteGameStore:
+    """
+    Shared store for multi-worker deployments. Each thread keeps its own
+    connection. A game is one `sessions` row (the state minus its history:
+    totals, rolling stats and the prompt text) plus one `rounds` row per
+    round, so committing a round writes only that round and loading one
+    parses only the rounds the response needs. Games expire after `ttl`
+    seconds without a write.
+    """
+
+    def __init__(self, path=GAME_STORE_PATH, ttl=GAME_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._db = SQLiteConnections(path, self.purge)
+        conn = self._db.get()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " game_id TEXT PRIMARY KEY,"
+            " epoch TEXT NOT NULL,"
+            " round INTEGER NOT NULL,"
+            " state TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rounds ("
+            " game_id TEXT NOT NULL,"
+            " epoch TEXT NOT NULL,"
+            " round INTEGER NOT NULL,"
+            " entry TEXT NOT NULL,"
+            " PRIMARY KEY (game_id, epoch, round))"
+        )
+
+    @contextmanager
+    def _write(self):
+        """BEGIN IMMEDIATE ... COMMIT: takes the write lock up front, so checks can't go stale."""
+        conn = self._db.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        self._db.wrote()
+
+    @staticmethod
+    def _head(state):
+        return json.dumps({k: v for k, v in state.items() if k != "history"})
+
+    def _put_head(self, conn, game_id, state):
+        conn.execute(
+            "INSERT INTO sessions (game_id, epoch, round, state, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(game_id) DO UPDATE SET epoch = excluded.epoch, round = excluded.round,"
+            " state = excluded.state, updated_at = excluded.updated_at",
+            (game_id, state["epoch"], state["round"], self._head(state), time.time()),
+        )
+
+    def load(self, game_id, since_round=0):
+        """
+        The stored game with the rounds after `since_round` (None: none
+        beyond what the advisor prompt needs) read from `rounds`. Earlier
+        slots of `history` are None, so history[i] is still round i+1 and
+        history_view()'s slice lands on real entries.
+        """
+        conn = self._db.get()
+        row = conn.execute(
+            "SELECT state FROM sessions WHERE game_id = ? AND updated_at >= ?",
+            (game_id, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        # the rolling prompt reads the last PROMPT_RECENT_ROUNDS rounds; a head
+        # without stats or prompt text (older rows, mode switch) rebuilds from all
+        skip = state["round"] - PROMPT_RECENT_ROUNDS
+        if since_round is not None:
+            skip = min(skip, since_round)
+        if state.get("stats") is None or (PROMPT_HISTORY == "full" and state.get("history_text") is None):
+            skip = 0
+        skip = max(0, skip)
+        state["history"] = [None] * skip + [json.loads(entry) for (entry,) in conn.execute(
+            "SELECT entry FROM rounds WHERE game_id = ? AND epoch = ? AND round > ? ORDER BY round",
+            (game_id, state["epoch"], skip),
+        )]
+        return state
+
+    def save(self, game_id, state):
+        """Store `state` unconditionally (new game, restart, replay)."""
+        with self._write() as conn:
+            conn.execute("DELETE FROM rounds WHERE game_id = ?", (game_id,))
+            conn.executemany(
+                "INSERT INTO rounds (game_id, epoch, round, entry) VALUES (?, ?, ?, ?)",
+                [(game_id, state["epoch"], h["round"], json.dumps(h)) for h in state["history"]],
+            )
+            self._put_head(conn, game_id, state)
+
+    def commit(self, game_id, state, entry):
+        """Append `entry` and the new head; RoundConflict if it no longer follows the stored game."""
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT epoch, round FROM sessions WHERE game_id = ? AND updated_at >= ?",
+                (game_id, time.time() - self.ttl),
+            ).fetchone()
+            if row is None:
+                if entry["round"] != 1:
+                    raise RoundConflict(game_id)
+                conn.execute("DELETE FROM rounds WHERE game_id = ?", (game_id,))  # expired game
+            elif row != (state["epoch"], entry["round"] - 1):
+                raise RoundConflict(game_id)
+            conn.execute(
+                "INSERT INTO rounds (game_id, epoch, round, entry) VALUES (?, ?, ?, ?)",
+                (game_id, state["epoch"], entry["round"], json.dumps(entry)),
+            )
+            self._put_head(conn, game_id, state)
+
+    def restore(self, game_id, state, last_ts):
+        """
+        Write a replayed `state` only if it is newer than the stored game:
+        the same epoch further along (just the missing rounds are added), or
+        another epoch last written before `last_ts`. Rounds other workers
+        committed but not yet logged are never rolled back. Returns True if
+        anything was written.
+        """
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT epoch, round, updated_at FROM sessions WHERE game_id = ?", (game_id,)
+            ).fetchone()
+            if row is not None and row[0] == state["epoch"]:
+                if row[1] >= state["round"]:
+                    return False
+                missing = state["history"][row[1]:]
+            elif row is not None and row[2] >= last_ts:
+                return False
+            else:
+                conn.execute("DELETE FROM rounds WHERE game_id = ?", (game_id,))
+                missing = state["history"]
+            conn.executemany(
+                "INSERT OR REPLACE INTO rounds (game_id, epoch, round, entry) VALUES (?, ?, ?, ?)",
+                [(game_id, state["epoch"], h["round"], json.dumps(h)) for h in missing],
+            )
+            self._put_head(conn, game_id, state)
+            return True
+
+    def delete(self, game_id):
+        with self._write() as conn:
+            conn.execute("DELETE FROM rounds WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM sessions WHERE game_id = ?", (game_id,))
+
+    def purge(self):
+        cutoff = time.time() - self.ttl
+        conn = self._db.get()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "DELETE FROM rounds WHERE game_id IN"
+            " (SELECT game_id FROM sessions WHERE updated_at < ?)", (cutoff,)
+        )
+        conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+        conn.execute("COMMIT")
+
+    def __len__(self):
+        row = self._db.get().execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?",
+            (time.time() - self.ttl,),
+        ).fetchone()
+        return row[0]
+
+
+def make_game_store(kind=GAME_STORE):
+    if kind == "memory":
+        return MemoryGameStore()
+    if kind == "sqlite":
+        return SQLiteGameStore()
+    raise ValueError(f"unknown GAME_STORE backend: {kind!r}")
+
+
+game_store = make_game_store()
+
+
+def explicit_game_id(data):
+    """game_id from the JSON body, then the X-Game-Id header; None if the client sent neither."""
+    game_id = data.get("game_id") or request.headers.get("X-Game-Id")
+    return str(game_id) if game_id else None
+
+
+def cookie_game_id():
+    return request.cookies.get(GAME_COOKIE) if GAME_COOKIE else None
+
+
+def request_game_id(data):
+    """Explicit game_id, then the game cookie, then the shared default."""
+    return explicit_game_id(data) or cookie_game_id() or DEFAULT_GAME_ID
+
+
+def set_game_cookie(resp, game_id):
+    resp.set_cookie(
+        GAME_COOKIE, game_id, max_age=int(GAME_STORE_TTL), httponly=True,
+        samesite=GAME_COOKIE_SAMESITE, secure=GAME_COOKIE_SAMESITE == "None",
+    )
+
+
+def load_game(game_id, since_round=0):
+    """The stored game (or a new one), with at least the rounds after `since_round` (see SQLiteGameStore.load)."""
+    state = game_store.load(game_id, since_round)
+    if state is None:
+        state = new_game_state()
+    return state
+
+
+# ============================================================
+# LLM SUGGESTION CACHE
+# ============================================================
+#  Same prompt + model -> same suggestion, without another API call.
+#  LLM_CACHE_PATH 非空时再加一层 SQLite，worker 重启后仍然有效。
+
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "4096"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "")
+
+
+def normalize_prompt(prompt):
+    return "\n".join(" ".join(line.split()) for line in prompt.strip().splitlines())
+
+
+class SuggestionCache:
+    """
+    Two-tier memo of advisor suggestions keyed by sha256(model, normalized prompt):
+    an in-process LRU with TTL, backed by an optional SQLite file shared by
+    all workers. Disk hits are promoted into memory; expired rows are swept
+    every SQLITE_PURGE_EVERY writes.
+    """
+
+    def __init__(self, max_size=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL, path=LLM_CACHE_PATH):
+        self.ttl = ttl
+        self.path = path
+        self._memory = LRUTTLCache(max_size, ttl)
+        self._db = SQLiteConnections(path, self.purge) if path else None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path:
+            conn = self._db.get()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS suggestions ("
+                " key TEXT PRIMARY KEY,"
+                " value INTEGER NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS suggestions_created_at ON suggestions (created_at)")
+
+    @staticmethod
+    def key(model, prompt):
+        return hashlib.sha256(f"{model}\0{normalize_prompt(prompt)}".encode()).hexdigest()
+
+    def get(self, key):
+        value = self._memory.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        if self.path:
+            row = self._db.get().execute(
+                "SELECT value FROM suggestions WHERE key = ? AND created_at >= ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+            if row:
+                self._memory.put(key, row[0])
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._memory.put(key, value)
+        if self.path:
+            self._db.get().execute(
+                "INSERT OR REPLACE INTO suggestions (key, value, created_at) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self._db.wrote()
+
+    def purge(self):
+        """Delete rows older than the TTL; get() already ignores them."""
+        if self.path:
+            self._db.get().execute(
+                "DELETE FROM suggestions WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self._memory),
+        }
+
+
+suggestion_cache = SuggestionCache()
+
+
+# ============================================================
+# METRICS
+# ============================================================
+#  Per-process counters and histograms, rendered in Prometheus text
+#  format by GET /metrics. Each gunicorn worker reports its own, so every
+#  series carries a pid label: a scrape that lands on another worker
+#  shows other series instead of a counter going backwards. Aggregate
+#  across workers in the query, e.g. sum without (pid) (rate(...)).
+#  METRICS_ENABLED=0 turns the hot-path timers into no-ops.
+#  PROFILE_SAMPLE_RATE>0 runs cProfile on that fraction of requests and
+#  serves the aggregate at GET /metrics/profile; off by default.
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_str(names, values, extra=""):
+    pairs = [f'pid="{os.getpid()}"'] + [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = _label_str(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_str(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def sample_lines(name, help_text, kind, samples):
+    """Render values owned elsewhere; samples is a list of (labels dict, value)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_label_str(labels.keys(), labels.values())} {value}")
+    return lines
+
+
+STAGE_SECONDS = Histogram(
+    "backend7_stage_seconds", "Time spent in each hot-path stage.", ("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "backend7_request_seconds", "Request latency, until the response body is sent.", ("endpoint",)
+)
+LLM_TOKENS = Counter(
+    "backend7_llm_tokens_total", "Tokens reported by the OpenAI API.", ("kind",)
+)
+LLM_FALLBACKS = Counter(
+    "backend7_llm_fallbacks_total", "LLM results replaced by a fallback.", ("caller", "reason")
+)
+PREFETCH_EVENTS = Counter(
+    "backend7_advisor_prefetch_total", "Speculative next-round advisor calls.", ("event",)
+)
+
+_profile_stats = None
+_profile_lock = threading.Lock()
+# one sampled profile at a time: from Python 3.12 cProfile sits on the
+# process-wide sys.monitoring, and a second enable() raises ValueError
+_profiler_slot = threading.Lock()
+
+
+@contextmanager
+def timed(stage):
+    if not METRICS_ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+
+
+def fallback_reason(exc):
+    return "circuit_open" if isinstance(exc, CircuitOpen) else "error"
+
+
+@app.before_request
+def _metrics_start():
+    g.request_started = time.perf_counter()
+    g.profiler = None
+    if (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+            and _profiler_slot.acquire(blocking=False)):  # busy: skip this sample
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler (not ours) is active
+            _profiler_slot.release()
+            return
+        g.profiler = profiler
+
+
+def _stop_profiler():
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profiler_slot.release()
+    return profiler
+
+
+@app.after_request
+def _metrics_finish(response):
+    global _profile_stats
+    profiler = _stop_profiler()
+    if profiler is not None:
+        with _profile_lock:
+            if _profile_stats is None:
+                _profile_stats = pstats.Stats(profiler)
+            else:
+                _profile_stats.add(profiler)
+    if METRICS_ENABLED and "request_started" in g:
+        started, endpoint = g.request_started, request.endpoint or "unknown"
+        # observed once the body has been sent, so streamed responses count the whole stream
+        response.call_on_close(lambda: REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint))
+    return response
+
+
+@app.teardown_request
+def _metrics_teardown(exc):
+    _stop_profiler()  # after_request was skipped; free the slot
+
+
+# ============================================================
+# OPENAI TRANSPORT
+# ============================================================
+#  One keep-alive connection pool per worker, explicit timeouts, retries
+#  drawn from a shared budget, and a circuit breaker: after
+#  BREAKER_FAILURES consecutive failures every call fails fast (callers
+#  serve their fallback) until a probe succeeds BREAKER_RESET seconds later.
+
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "10"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "2"))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", "20"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+# 重试次数最多占调用次数的这个比例，上游变慢时不会被重试放大
+LLM_RETRY_RATIO = float(os.environ.get("LLM_RETRY_RATIO", "0.2"))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", "30"))
+
+# filled in by get_client() together with the (slow) openai import
+RETRYABLE_ERRORS = ()
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling OpenAI while the breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive failures;
+    open -> half_open after `reset` seconds, letting one probe call through;
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.failure_threshold = failures
+        self.reset = reset
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class RetryBudget:
+    """
+    Token bucket: every call deposits `ratio` tokens, every retry spends one.
+    Retries stop once the bucket is empty instead of multiplying load.
+    """
+
+    def __init__(self, ratio=LLM_RETRY_RATIO, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.spent = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def snapshot(self):
+        return {"tokens": round(self.tokens, 3), "spent": self.spent, "denied": self.denied}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The shared OpenAI client, created on first use. Importing openai is the
+    slowest part of startup and building the client needs credentials, so
+    neither happens at import; under `--preload` each worker also gets its
+    own connection pool instead of one inherited across fork.
+    """
+    global _client, RETRYABLE_ERRORS
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from openai import (
+                    OpenAI,
+                    DefaultHttpxClient,
+                    APIConnectionError,
+                    InternalServerError,
+                    RateLimitError,
+                )
+
+                RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+                _client = OpenAI(
+                    http_client=DefaultHttpxClient(
+                        limits=httpx.Limits(
+                            max_connections=LLM_MAX_CONNECTIONS,
+                            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                        ),
+                        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+                    ),
+                    max_retries=0,  # retries go through llm_call so they draw on retry_budget
+                )
+    return _client
+
+
+breaker = CircuitBreaker()
+retry_budget = RetryBudget()
+
+
+def llm_call(timeout=LLM_TIMEOUT, **kwargs):
+    """
+    client.chat.completions.create behind the breaker and retry budget.
+    Raises CircuitOpen without touching the network while the breaker is open.
+    Streaming callers should report mid-stream errors via breaker.record_failure().
+    """
+    if not breaker.allow():
+        raise CircuitOpen()
+    try:
+        client = get_client()
+    except Exception:
+        breaker.record_failure()
+        raise
+    retry_budget.deposit()
+    give_up_at = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            resp = client.chat.completions.create(
+                timeout=max(0.05, give_up_at - time.monotonic()), **kwargs
+            )
+        except RETRYABLE_ERRORS:
+            backoff = min(2.0, 0.25 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if (attempt < LLM_MAX_RETRIES
+                    and time.monotonic() + backoff < give_up_at
+                    and retry_budget.try_spend()):
+                attempt += 1
+                time.sleep(backoff)
+                continue
+            breaker.record_failure()
+            raise
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens, "prompt")
+            LLM_TOKENS.inc(usage.completion_tokens, "completion")
+        return resp
+
 
 # === PERSONA & STRATEGY 配置 =================================
 
@@ -62,40 +974,263 @@ PERSONA_PROFILES = {
 
 
 # ============================================================
-# PAYOFF FALLBACK
+# PAYOFF ENGINE
 # ============================================================
+#  The literal tables (payoff_tables.py) are validated and compiled into two
+#  read-only 25×25 float arrays indexed [am_inv, mc_inv], 0..24 on both
+#  axes. Each raw table stops at 24 for its own side's investment (AM has
+#  no am=25 row, MC no mc=25 column), so level 25 was never measured and
+#  every move is clamped to MAX_INVESTMENT = 24; the unused mc=25 column
+#  of AM_PAYOFFS and am=25 row of MC_PAYOFFS are dropped.
+#  The compiled arrays are cached in PAYOFF_ASSET_PATH and memory-mapped,
+#  so workers (and forks of a --preload master) share one page-cache copy
+#  and skip building the literal lists; a changed payoff_tables.py is
+#  detected by hash and triggers a rebuild.
+
+PAYOFF_LEVELS = 25  # investment levels measured by both tables
+MAX_INVESTMENT = PAYOFF_LEVELS - 1
+RAW_LEVELS = 26  # the raw tables also list level 25 for the other side
+
+
+def _compile_payoffs(am_raw, mc_raw):
+    levels = np.arange(RAW_LEVELS, dtype=np.float64)
+    try:
+        am_header = np.array(am_raw[0], dtype=np.float64)
+        am_data = np.array(am_raw[1:], dtype=np.float64)
+        mc_header = np.array(mc_raw[0][1:], dtype=np.float64)
+        mc_labels = np.array([row[0] for row in mc_raw[1:]], dtype=np.float64)
+        mc_data = np.array([row[1:] for row in mc_raw[1:]], dtype=np.float64)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"payoff tables are ragged or non-numeric: {e}") from None
+
+    if am_data.shape != (RAW_LEVELS - 1, RAW_LEVELS):
+        raise ValueError(f"AM_PAYOFFS data must be 25×26, got {am_data.shape}")
+    if mc_data.shape != (RAW_LEVELS, RAW_LEVELS - 1):
+        raise ValueError(f"MC_PAYOFFS data must be 26×25, got {mc_data.shape}")
+    if not np.array_equal(am_header, levels):
+        raise ValueError("AM_PAYOFFS header row must be 0..25")
+    if not np.array_equal(mc_header, levels[:-1]) or not np.array_equal(mc_labels, levels):
+        raise ValueError("MC_PAYOFFS headers must be 0..24 (row) and 0..25 (column)")
+    if not (np.isfinite(am_data).all() and np.isfinite(mc_data).all()):
+        raise ValueError("payoff tables contain non-finite values")
+
+    am_table = np.ascontiguousarray(am_data[:PAYOFF_LEVELS, :PAYOFF_LEVELS])
+    mc_table = np.ascontiguousarray(mc_data[:PAYOFF_LEVELS, :PAYOFF_LEVELS])
+    am_table.setflags(write=False)
+    mc_table.setflags(write=False)
+    return am_table, mc_table
+
+
+PAYOFF_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payoff_tables.py")
+PAYOFF_ASSET_PATH = os.environ.get(
+    "PAYOFF_ASSET_PATH", os.path.join(os.path.dirname(PAYOFF_SOURCE), "payoff_tables.b7")
+)
+# layout: magic | uint64 header length | JSON header | padding | float64[2, 25, 25]
+PAYOFF_ASSET_MAGIC = b"B7PAYOFF"
+PAYOFF_ASSET_ALIGN = 64
+
+
+def _payoff_source_hash():
+    with open(PAYOFF_SOURCE, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def build_payoff_asset(path=PAYOFF_ASSET_PATH):
+    """Compile payoff_tables.py into the binary asset at `path` (atomic replace)."""
+    import payoff_tables
+
+    am_table, mc_table = _compile_payoffs(payoff_tables.AM_PAYOFFS, payoff_tables.MC_PAYOFFS)
+    data = np.stack([am_table, mc_table]).astype("<f8")
+    header = json.dumps({
+        "source_sha256": _payoff_source_hash(),
+        "dtype": "<f8",
+        "shape": list(data.shape),
+    }).encode()
+    offset = len(PAYOFF_ASSET_MAGIC) + 8 + len(header)
+    padding = -offset % PAYOFF_ASSET_ALIGN
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(PAYOFF_ASSET_MAGIC)
+        f.write(len(header).to_bytes(8, "little"))
+        f.write(header)
+        f.write(b"\0" * padding)
+        f.write(data.tobytes())
+    os.replace(tmp, path)
+    return am_table, mc_table
+
+
+def _map_payoff_asset(path):
+    """Memory-map a current asset; raises ValueError if it is stale or malformed."""
+    with open(path, "rb") as f:
+        if f.read(len(PAYOFF_ASSET_MAGIC)) != PAYOFF_ASSET_MAGIC:
+            raise ValueError("not a payoff asset")
+        header_len = int.from_bytes(f.read(8), "little")
+        header = json.loads(f.read(header_len))
+    if header["source_sha256"] != _payoff_source_hash():
+        raise ValueError("payoff asset is stale")
+    shape = tuple(header["shape"])
+    if shape != (2, PAYOFF_LEVELS, PAYOFF_LEVELS):
+        raise ValueError(f"unexpected payoff asset shape {shape}")
+    offset = len(PAYOFF_ASSET_MAGIC) + 8 + header_len
+    offset += -offset % PAYOFF_ASSET_ALIGN
+    tables = np.asarray(np.memmap(path, dtype=header["dtype"], mode="r", offset=offset, shape=shape))
+    return tables[0], tables[1]
+
+
+def load_payoff_tables(path=PAYOFF_ASSET_PATH):
+    try:
+        return _map_payoff_asset(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        build_payoff_asset(path)
+        return _map_payoff_asset(path)
+    except OSError:
+        # read-only checkout: compile in memory every start instead
+        import payoff_tables
+        return _compile_payoffs(payoff_tables.AM_PAYOFFS, payoff_tables.MC_PAYOFFS)
+
+
+AM_TABLE, MC_TABLE = load_payoff_tables()
+# plain nested lists for the scalar path: list indexing beats NumPy scalar access ~20x
+AM_ROWS, MC_ROWS = AM_TABLE.tolist(), MC_TABLE.tolist()
+
+
+def __getattr__(name):
+    # backend7.AM_PAYOFFS / MC_PAYOFFS still work; the literals load on first access
+    if name in ("AM_PAYOFFS", "MC_PAYOFFS"):
+        import payoff_tables
+        return getattr(payoff_tables, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# best reply to the other side's level: AM_BEST_RESPONSE[mc] / MC_BEST_RESPONSE[am]
+AM_BEST_RESPONSE = AM_TABLE.argmax(axis=0)
+MC_BEST_RESPONSE = MC_TABLE.argmax(axis=1)
+AM_BEST_VALUE = AM_TABLE.max(axis=0)
+MC_BEST_VALUE = MC_TABLE.max(axis=1)
+
 
 def compute_payoff(am_inv, mc_inv):
+    if not (type(am_inv) is int and type(mc_inv) is int
+            and 0 <= am_inv <= MAX_INVESTMENT and 0 <= mc_inv <= MAX_INVESTMENT):
+        # slow path: floats, NumPy ints, out-of-range moves
+        am_inv = max(0, min(MAX_INVESTMENT, int(am_inv)))
+        mc_inv = max(0, min(MAX_INVESTMENT, int(mc_inv)))
+    return AM_ROWS[am_inv][mc_inv], MC_ROWS[am_inv][mc_inv]
+
+
+def payoff_lookup(am_inv, mc_inv):
+    """Vectorized compute_payoff for integer arrays (clipped to 0..MAX_INVESTMENT)."""
+    idx = (np.clip(am_inv, 0, MAX_INVESTMENT) * PAYOFF_LEVELS
+           + np.clip(mc_inv, 0, MAX_INVESTMENT))
+    return AM_TABLE.ravel().take(idx), MC_TABLE.ravel().take(idx)
+
+
+def best_response_am(mc_inv):
+    return int(AM_BEST_RESPONSE[mc_inv])
+
+
+def best_response_mc(am_inv):
+    return int(MC_BEST_RESPONSE[am_inv])
+
+
+# pure equilibria: cells that are a best reply for both sides at once (ties included)
+PURE_EQUILIBRIA = [
+    (int(a), int(m))
+    for a, m in zip(*np.nonzero((AM_TABLE == AM_BEST_VALUE[None, :])
+                                & (MC_TABLE == MC_BEST_VALUE[:, None])))
+]
+
+
+def _indifferent_mix(payoffs, tol):
     """
-    If AM_PAYOFFS/MC_PAYOFFS are empty, fallback to a simple payoff.
+    Mix over the columns of the square `payoffs` that makes every row pay
+    the same. Returns None if there is no such probability vector.
     """
-    if AM_PAYOFFS and MC_PAYOFFS:
-        try:
-            return AM_PAYOFFS[am_inv][mc_inv], MC_PAYOFFS[am_inv][mc_inv]
-        except:
-            pass
-    # fallback: 简单差额结构
-    return (am_inv - mc_inv, mc_inv - am_inv)
+    k = payoffs.shape[0]
+    system = np.zeros((k + 1, k + 1))
+    system[:k, :k] = payoffs
+    system[:k, k] = -1.0
+    system[k, :k] = 1.0
+    rhs = np.zeros(k + 1)
+    rhs[k] = 1.0
+    try:
+        mix = np.linalg.solve(system, rhs)[:k]
+    except np.linalg.LinAlgError:
+        return None
+    if (mix < -tol).any():
+        return None
+    return np.clip(mix, 0.0, None)
+
+
+def nash_equilibria(max_support=2, tol=1e-9):
+    """
+    Nash equilibria of the stage game as (am_mix, mc_mix) probability
+    vectors over the 25 levels: every pure equilibrium plus the mixed ones
+    found by support enumeration over equal-size supports up to
+    `max_support`. Cost grows as C(25, k)² — keep `max_support` small.
+    """
+    found = []
+    for a, m in PURE_EQUILIBRIA:
+        am_mix = np.zeros(PAYOFF_LEVELS)
+        mc_mix = np.zeros(PAYOFF_LEVELS)
+        am_mix[a] = mc_mix[m] = 1.0
+        found.append((am_mix, mc_mix))
+
+    for k in range(2, max_support + 1):
+        for rows in combinations(range(PAYOFF_LEVELS), k):
+            am_rows = AM_TABLE[list(rows)]
+            mc_rows = MC_TABLE[list(rows)]
+            for cols in combinations(range(PAYOFF_LEVELS), k):
+                q = _indifferent_mix(am_rows[:, cols], tol)
+                if q is None:
+                    continue
+                p = _indifferent_mix(mc_rows[:, cols].T, tol)
+                if p is None:
+                    continue
+                am_mix = np.zeros(PAYOFF_LEVELS)
+                mc_mix = np.zeros(PAYOFF_LEVELS)
+                am_mix[list(rows)] = p
+                mc_mix[list(cols)] = q
+                am_values = AM_TABLE @ mc_mix
+                mc_values = am_mix @ MC_TABLE
+                if (am_values.max() <= am_mix @ am_values + tol
+                        and mc_values.max() <= mc_values @ mc_mix + tol):
+                    found.append((am_mix, mc_mix))
+    return found
 
 
 # ============================================================
 # STRATEGIES
 # ============================================================
+#  Each strategy has a batch_* twin right below it: the same rule applied
+#  to every game of a batch at once (`vs` holds one NumPy array per state
+#  field, see BATCH SIMULATION). Change them together.
 
 def cooperative_strategy(state):
     """More likely to invest higher."""
     base = 18 + random.randint(-2, 2)
-    return max(0, min(25, base))
+    return max(0, min(MAX_INVESTMENT, base))
+
+def batch_cooperative(rng, vs):
+    return np.clip(18 + rng.integers(-2, 3, vs["n"]), 0, MAX_INVESTMENT)
 
 def competitive_strategy(state):
     """More likely to invest minimal."""
     base = 3 + random.randint(-1, 1)
-    return max(0, min(25, base))
+    return max(0, min(MAX_INVESTMENT, base))
+
+def batch_competitive(rng, vs):
+    return np.clip(3 + rng.integers(-1, 2, vs["n"]), 0, MAX_INVESTMENT)
 
 def balanced_strategy(state):
     """Middle point."""
     base = 12 + random.randint(-3, 3)
-    return max(0, min(25, base))
+    return max(0, min(MAX_INVESTMENT, base))
+
+def batch_balanced(rng, vs):
+    return np.clip(12 + rng.integers(-3, 4, vs["n"]), 0, MAX_INVESTMENT)
 
 def adaptive_strategy(state):
     """
@@ -113,71 +1248,174 @@ def adaptive_strategy(state):
     else:
         base = last_am - 2
 
-    return max(0, min(25, base + random.randint(-1, 1)))
+    return max(0, min(MAX_INVESTMENT, base + random.randint(-1, 1)))
+
+def batch_adaptive(rng, vs):
+    if vs["round"] == 0:
+        return batch_balanced(rng, vs)
+    base = np.where(vs["am_total"] < vs["mc_total"], vs["last_am"] + 3, vs["last_am"] - 2)
+    return np.clip(base + rng.integers(-1, 2, vs["n"]), 0, MAX_INVESTMENT)
 
 
 # ============================================================
 # STRATEGY WRAPPER
 # ============================================================
 
+# play(state) -> one move for the live game; batch(rng, vs) -> one move per
+# game for batch_simulate / tournament.py. A strategy needs both.
+Strategy = namedtuple("Strategy", "play batch")
+
+# name -> Strategy；新策略在这里注册即可（两个实现都要写）
+AM_STRATEGIES = {
+    "cooperative": Strategy(cooperative_strategy, batch_cooperative),
+    "competitive": Strategy(competitive_strategy, batch_competitive),
+    "balanced": Strategy(balanced_strategy, batch_balanced),
+    "adaptive": Strategy(adaptive_strategy, batch_adaptive),
+}
+
+# weight of the strategy suggestion vs. the LLM suggestion in decide_am_investment
+STRATEGY_WEIGHT = 0.6
+
+
 def strategy_pick(strategy_name, state):
-    if strategy_name == "cooperative":
-        return cooperative_strategy(state)
-    elif strategy_name == "competitive":
-        return competitive_strategy(state)
-    elif strategy_name == "balanced":
-        return balanced_strategy(state)
-    elif strategy_name == "adaptive":
-        return adaptive_strategy(state)
-    else:
-        return balanced_strategy(state)
+    return AM_STRATEGIES.get(strategy_name, AM_STRATEGIES["balanced"]).play(state)
 
 
 # ============================================================
 # LLM DECISION (GPT-4o-mini)
 # ============================================================
 
-def llm_decide_investment(state):
+def history_line(entry):
+    return (
+        f"Round {entry['round']}: AM={entry['am']}, MC={entry['mc']}, "
+        f"AM_pay={entry['am_pay']}, MC_pay={entry['mc_pay']}"
+    )
+
+
+def history_text(state):
     """
-    Produces an investment guess (0–25).
+    Prompt history for `state`. play_round appends one line per round;
+    states saved before `history_text` existed are rebuilt once here.
     """
-    if not game_state["history"]:
-        history_text = "(no previous rounds)"
+    text = state.get("history_text")
+    if text is None:
+        text = state["history_text"] = "\n".join(history_line(h) for h in state["history"])
+    return text
+
+
+def update_history_stats(stats, entry, prev_mc):
+    """Fold one round into the running stats in O(1) (Welford mean/variance)."""
+    stats["n"] += 1
+    n = stats["n"]
+    for side in ("am", "mc"):
+        move = entry[side]
+        delta = move - stats[f"{side}_mean"]
+        stats[f"{side}_mean"] += delta / n
+        stats[f"{side}_m2"] += delta * (move - stats[f"{side}_mean"])
+
+    if entry["am_pay"] > entry["mc_pay"]:
+        side = "AM"
+    elif entry["am_pay"] < entry["mc_pay"]:
+        side = "MC"
     else:
-        history_text = "\n".join(
-            [
-                f"Round {i+1}: AM={h['am']}, MC={h['mc']}, AM_pay={h['am_pay']}, MC_pay={h['mc_pay']}"
-                for i, h in enumerate(state["history"])
-            ]
-        )
+        side = "tie"
+    if side == stats["streak_side"]:
+        stats["streak_len"] += 1
+    else:
+        stats["streak_side"] = side
+        stats["streak_len"] = 1
+
+    if prev_mc is not None:
+        stats["mc_trend"] += MC_TREND_ALPHA * ((entry["mc"] - prev_mc) - stats["mc_trend"])
+
+
+def history_stats(state):
+    """Running stats for `state`; states saved before `stats` existed are rebuilt once."""
+    stats = state.get("stats")
+    if stats is None:
+        stats = state["stats"] = new_history_stats()
+        prev_mc = None
+        for h in state["history"]:
+            update_history_stats(stats, h, prev_mc)
+            prev_mc = h["mc"]
+    return stats
+
+
+def rolling_history_text(state):
+    """Constant-size history: one summary line plus the last PROMPT_RECENT_ROUNDS rounds."""
+    history = state["history"]
+    recent = "\n".join(history_line(h) for h in history[-PROMPT_RECENT_ROUNDS:])
+    if len(history) <= PROMPT_RECENT_ROUNDS:
+        return recent
+
+    st = history_stats(state)
+    n = st["n"]
+    if st["streak_side"] == "tie":
+        streak = f"the last {st['streak_len']} round(s) were ties"
+    else:
+        other = "MC" if st["streak_side"] == "AM" else "AM"
+        streak = f"{st['streak_side']} has out-earned {other} in each of the last {st['streak_len']} round(s)"
+    summary = (
+        f"Summary of all {n} rounds: cumulative payoff AM={state['am_total']}, MC={state['mc_total']}; "
+        f"AM investment mean={st['am_mean']:.1f} sd={math.sqrt(st['am_m2'] / n):.1f}; "
+        f"MC investment mean={st['mc_mean']:.1f} sd={math.sqrt(st['mc_m2'] / n):.1f}; "
+        f"{streak}; MC's recent trend is {st['mc_trend']:+.1f} per round."
+    )
+    return f"{summary}\nLast {min(n, PROMPT_RECENT_ROUNDS)} rounds:\n{recent}"
+
+
+def prompt_history(state):
+    if PROMPT_HISTORY == "rolling":
+        return rolling_history_text(state)
+    return history_text(state)
+
+
+def llm_decide_investment(state):
+    """
+    Produces an investment guess (0–MAX_INVESTMENT).
+    """
+    history_block = state.get("prompt_history")
+    if history_block is None:
+        history_block = prompt_history(state)
 
     prompt = f"""
 You are the AM agent in a repeated investment game.
-Each round both sides choose an investment between 0 and 25.
+Each round both sides choose an investment between 0 and {MAX_INVESTMENT}.
 Higher investment can help long-term competitiveness but also costs more.
 The opponent is 'MC'.
 
 History so far:
-{history_text}
+{history_block or "(no previous rounds)"}
 
 Now we are entering round {state["round"]+1}.
-Given this context, choose ONE integer between 0 and 25 as your next AM investment.
+Given this context, choose ONE integer between 0 and {MAX_INVESTMENT} as your next AM investment.
 Return ONLY the number, no explanation.
 """
 
+    cache_key = SuggestionCache.key(LLM_MODEL, prompt)
+    cached = suggestion_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}]
-        )
+        with timed("llm"):
+            resp = llm_call(
+                model=LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                timeout=ROUND_DEADLINE,
+            )
         content = resp.choices[0].message.content.strip()
         digits = "".join([c for c in content if c.isdigit()])
         val = int(digits) if digits else 12
-        return max(0, min(25, val))
-    except Exception:
-        # fallback
+        val = max(0, min(MAX_INVESTMENT, val))
+    except Exception as e:
+        # fallback — 不进缓存
+        LLM_FALLBACKS.inc(1, "advisor", fallback_reason(e))
         return balanced_strategy(state)
 
+    suggestion_cache.put(cache_key, val)
+    return val
+
 
 # ============================================================
 # COMPLEX REASONING + PERSONA
@@ -273,89 +1511,945 @@ def generate_reasoning(am_choice, strategy_name, llm_used, state):
 # ONE-ROUND DECISION
 # ============================================================
 
-def decide_am_investment(state, strategy_name):
+advisor_pool = ThreadPoolExecutor(max_workers=ADVISOR_WORKERS, thread_name_prefix="advisor")
+
+
+def submit_advisor(state, pool=None):
+    """
+    Start the LLM suggestion for the round `state` is about to play.
+    The advisor works on a snapshot, so the caller may keep mutating `state`;
+    it only reads the prompt history rendered here, never the history list.
+    """
+    snapshot = dict(state, prompt_history=prompt_history(state))
+    return (pool or advisor_pool).submit(llm_decide_investment, snapshot)
+
+
+def await_advisor(future, state, deadline):
+    """Wait for the advisor until `deadline` (monotonic); fall back to balanced_strategy."""
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        future.cancel()
+        LLM_FALLBACKS.inc(1, "advisor", "deadline")
+        return balanced_strategy(state)
+
+
+def decide_am_investment(state, strategy_name, advisor=None, deadline=None):
+    if deadline is None:
+        deadline = time.monotonic() + ROUND_DEADLINE
+    # llm suggestion — in flight while the strategy runs
+    if advisor is None:
+        advisor = submit_advisor(state)
     # strategy suggestion
-    strat_choice = strategy_pick(strategy_name, state)
-    # llm suggestion
-    llm_choice = llm_decide_investment(state)
+    with timed("strategy_pick"):
+        strat_choice = strategy_pick(strategy_name, state)
+    with timed("advisor_wait"):
+        llm_choice = await_advisor(advisor, state, deadline)
 
     # 简单线性融合（你之后可以改更复杂的权重机制）
-    final = round((strat_choice * 0.6) + (llm_choice * 0.4))
-    final = max(0, min(25, final))
+    final = round((strat_choice * STRATEGY_WEIGHT) + (llm_choice * (1 - STRATEGY_WEIGHT)))
+    final = max(0, min(MAX_INVESTMENT, final))
 
-    reasoning = generate_reasoning(final, strategy_name, llm_choice, state)
+    with timed("generate_reasoning"):
+        reasoning = generate_reasoning(final, strategy_name, llm_choice, state)
     return final, reasoning
 
 
 def decide_mc_investment(state):
     # MC 简单 policy：12 左右波动
     base = 12 + random.randint(-4, 4)
-    return max(0, min(25, base))
+    return max(0, min(MAX_INVESTMENT, base))
+
+
+def play_round(state, strategy_name, advisor=None):
+    """
+    Play one round on `state` in place and return the new history entry.
+    The advisor call is sent first so strategy and MC policy run while
+    it is in flight; the whole round is bounded by ROUND_DEADLINE.
+    """
+    deadline = time.monotonic() + ROUND_DEADLINE
+    if advisor is None:
+        advisor = submit_advisor(state)
+
+    with timed("mc_policy"):
+        mc_inv = decide_mc_investment(state)
+    am_inv, reasoning = decide_am_investment(state, strategy_name, advisor, deadline)
+
+    with timed("compute_payoff"):
+        am_pay, mc_pay = compute_payoff(am_inv, mc_inv)
+
+    entry = {
+        "round": state["round"] + 1,
+        "am": am_inv,
+        "mc": mc_inv,
+        "am_pay": am_pay,
+        "mc_pay": mc_pay,
+        "am_reasoning": reasoning,  # list[str] with persona reasoning
+    }
+    commit_round(state, entry)
+    return entry
+
+
+def commit_round(state, entry):
+    """Fold a played round into `state`; also used to replay the event log."""
+    stats = history_stats(state)
+    prev_mc = state["last_mc"]
+    state["am_total"] += entry["am_pay"]
+    state["mc_total"] += entry["mc_pay"]
+    state["last_am"] = entry["am"]
+    state["last_mc"] = entry["mc"]
+    update_history_stats(stats, entry, prev_mc)
+    if PROMPT_HISTORY == "full":
+        prev_text = history_text(state)
+        state["history_text"] = f"{prev_text}\n{history_line(entry)}" if prev_text else history_line(entry)
+    else:
+        state["history_text"] = None  # rebuilt by history_text() if the mode changes
+    state["history"].append(entry)
+    state["round"] += 1
+
+
+def history_view(history, since_round=0, fields=None):
+    """
+    Rounds after `since_round`, each trimmed to `fields` ("round" is always
+    kept). history[i] is round i+1, so the slice costs only the delta.
+    """
+    rounds = history[since_round:] if since_round > 0 else history
+    if fields:
+        keep = set(fields) | {"round"}
+        rounds = [{k: v for k, v in h.items() if k in keep} for h in rounds]
+    return rounds
+
+
+def history_etag(game_id, state):
+    # the epoch keeps a tag from before a restart from matching the new game
+    return f'"{game_id}:{state["epoch"]}:{state["round"]}"'
+
+
+def delta_params(data, game_id):
+    """
+    (since_round, fields, tag_epoch) for a history response. since_round
+    comes from the body, else from an If-None-Match ETag issued for this
+    game, whose epoch is returned as tag_epoch (None otherwise): the
+    caller must send the full history if the game has since been
+    restarted. Without either the full history is sent, as old front-ends
+    expect. ValueError if since_round or fields is malformed.
+    """
+    since_round = data.get("since_round")
+    tag_epoch = None
+    if since_round is None:
+        etag = request.headers.get("If-None-Match", "").removeprefix("W/").strip('"')
+        parts = etag.rsplit(":", 2)
+        if len(parts) == 3 and parts[0] == game_id and parts[2].isdigit():
+            since_round, tag_epoch = parts[2], parts[1]
+    try:
+        since_round = max(0, int(since_round or 0))
+    except (TypeError, ValueError):
+        raise ValueError("since_round must be an integer") from None
+    return since_round, request_fields(data), tag_epoch
+
+
+def request_fields(data):
+    """`fields` as a list of names (from a list or a comma-separated string); ValueError otherwise."""
+    fields = data.get("fields")
+    if isinstance(fields, str):
+        fields = [f.strip() for f in fields.split(",") if f.strip()]
+    elif fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+        raise ValueError("fields must be a list of names or a comma-separated string")
+    return fields
 
 
 # ============================================================
-# ENDPOINTS
+# ADVISOR PREFETCH
 # ============================================================
+#  The next round's prompt does not depend on the user's strategy, so as
+#  soon as a round is committed the next advisor call is started and
+#  parked here per game. The next /continue_simulation picks it up
+#  (finished or still in flight) if it is for the same epoch and round.
+#  Process-local: a request landing on another worker just misses.
+
+PREFETCH = os.environ.get("PREFETCH", "1") != "0"
+PREFETCH_TTL = float(os.environ.get("PREFETCH_TTL", "120"))
+PREFETCH_MAX_GAMES = int(os.environ.get("PREFETCH_MAX_GAMES", "10000"))
+# prefetches get their own, smaller pool so they never hold up a live round
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS") or max(1, ADVISOR_WORKERS // 2))
+
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+class AdvisorPrefetcher:
+    def __init__(self, max_games=PREFETCH_MAX_GAMES, ttl=PREFETCH_TTL):
+        self._pending = LRUTTLCache(max_games, ttl)  # game_id -> (epoch, round, future)
+
+    def start(self, game_id, state):
+        self.cancel(game_id)
+        if not PREFETCH or state["round"] >= MAX_ROUNDS:
+            return
+        future = submit_advisor(state, prefetch_pool)
+        self._pending.put(game_id, (state.get("epoch"), state["round"], future))
+        PREFETCH_EVENTS.inc(1, "started")
+
+    def take(self, game_id, state):
+        """The parked advisor future for the round `state` is about to play, or None."""
+        entry = self._pending.get(game_id)
+        if entry is None:
+            PREFETCH_EVENTS.inc(1, "miss")
+            return None
+        self._pending.delete(game_id)
+        epoch, round_idx, future = entry
+        if epoch != state.get("epoch") or round_idx != state["round"] or future.cancelled():
+            future.cancel()
+            PREFETCH_EVENTS.inc(1, "stale")
+            return None
+        if future.cancel():
+            # still queued behind other prefetches: the caller submits it to advisor_pool
+            PREFETCH_EVENTS.inc(1, "queued")
+            return None
+        PREFETCH_EVENTS.inc(1, "hit" if future.done() else "in_flight")
+        return future
+
+    def cancel(self, game_id):
+        """Forget a parked call; one already running finishes and is ignored."""
+        entry = self._pending.get(game_id)
+        if entry is not None:
+            self._pending.delete(game_id)
+            entry[2].cancel()
+            PREFETCH_EVENTS.inc(1, "cancelled")
+
+    def __len__(self):
+        return len(self._pending)
+
+
+prefetcher = AdvisorPrefetcher()
 
-@app.route("/start_simulation", methods=["POST"])
-def start_sim():
-    global game_state
-    game_state = {
+
+# ============================================================
+# EVENT LOG (append-only, replayed per worker)
+# ============================================================
+#  Every (re)start and every committed round is appended to EVENT_LOG_PATH
+#  as one JSON line. Requests only enqueue the event; a background writer
+#  drains the queue in batches and makes each batch durable with a single
+#  write + fsync (group commit), so the round path never waits on disk.
+#  Under gevent the disk work and checkpoint folds run on the hub's OS
+#  threadpool, off the event loop.
+#  Events still queued when the process dies (at most one batch window,
+#  EVENT_LOG_FLUSH_MS) are lost; a torn last line is skipped on replay.
+#  Each batch goes out as one O_APPEND write, so several workers can share
+#  the file. Off unless EVENT_LOG_PATH is set (e.g. game_events.jsonl).
+#  The log only grows, about 1 KB per round, and is never rotated;
+#  checkpoints bound replay time, not its size. Archive it (and remove
+#  <log>.ckpt) while the server is stopped.
+#  Every EVENT_LOG_CHECKPOINT_BYTES of new log, the live games are folded
+#  into a checkpoint (<log>.ckpt: states + the log offset they cover), so
+#  replay reads the checkpoint plus a bounded tail, not the whole log.
+#  EVENT_LOG_REPLAY=1 rebuilds a GAME_STORE=memory store from checkpoint +
+#  tail once per process, after fork (gunicorn post_fork, else the first
+#  request), so a respawned worker sees the log as it is now. Off by
+#  default, and skipped for GAME_STORE=sqlite, which is its own record.
+
+EVENT_LOG_PATH = os.environ.get("EVENT_LOG_PATH", "")
+EVENT_LOG_FLUSH_MS = float(os.environ.get("EVENT_LOG_FLUSH_MS", "5"))
+EVENT_LOG_BATCH = int(os.environ.get("EVENT_LOG_BATCH", "1024"))  # events per write
+EVENT_LOG_MAX_PENDING = int(os.environ.get("EVENT_LOG_MAX_PENDING", "100000"))
+EVENT_LOG_FSYNC = os.environ.get("EVENT_LOG_FSYNC", "1") != "0"
+EVENT_LOG_CHECKPOINT_BYTES = int(os.environ.get("EVENT_LOG_CHECKPOINT_BYTES", str(16 << 20)))
+EVENT_LOG_REPLAY = os.environ.get("EVENT_LOG_REPLAY", "0") != "0"
+EXPORT_MAX_LIMIT = 10_000  # games per /export page
+
+
+def run_in_os_thread(fn, *args):
+    """
+    fn(*args) on a real OS thread, waiting for the result. Under gevent
+    threading.Thread is a greenlet, and a blocking write/fsync there would
+    stall every request on the worker; gevent's hub threadpool runs it
+    off the event loop instead. Without gevent the caller already is one.
+    """
+    if _gevent_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+def start_os_thread(fn, name):
+    """Run fn() in the background on a real OS thread (see run_in_os_thread)."""
+    if _gevent_patched():
+        import gevent
+        gevent.get_hub().threadpool.spawn(fn)
+    else:
+        threading.Thread(target=fn, name=name, daemon=True).start()
+
+
+class EventLog:
+    """
+    Batched append-only JSONL writer. `append` is O(1) and never touches
+    the file; `flush` blocks until everything appended so far is on disk.
+    The file and writer thread are (re)opened lazily per process, so a
+    gunicorn --preload master can import the module and fork safely.
+    """
+
+    def __init__(self, path=EVENT_LOG_PATH, flush_ms=EVENT_LOG_FLUSH_MS,
+                 batch=EVENT_LOG_BATCH, max_pending=EVENT_LOG_MAX_PENDING, fsync=EVENT_LOG_FSYNC,
+                 checkpoint_bytes=EVENT_LOG_CHECKPOINT_BYTES):
+        self.path = path
+        self.checkpoint_bytes = checkpoint_bytes  # 0 = never checkpoint
+        self.flush_interval = flush_ms / 1000
+        self.batch = batch
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        self._pending = deque()
+        self._fd = None
+        self._appended = 0  # sequence number of the last appended event
+        self._durable = 0  # ... and of the last one on disk (or dropped)
+        self.written = 0
+        self.batches = 0
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.checkpoints = 0
+        self._since_checkpoint = 0
+        self._checkpointing = False
+
+    def _ensure_writer(self):
+        if self._pid == os.getpid():
+            return
+        self._reset()  # after fork: the parent's queue, fd and thread are not ours
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name="event-log", daemon=True).start()
+
+    def append(self, event):
+        """Queue one event (a JSON-serializable dict) for the next batch."""
+        with self._cond:
+            self._ensure_writer()
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1  # writer stuck on a failing disk; don't grow without bound
+                self._appended += 1
+                self._durable += 1
+                return
+            self._pending.append(event)
+            self._appended += 1
+            self._cond.notify()
+
+    def flush(self, timeout=None):
+        """Wait until every event appended before this call is durable. False on timeout."""
+        with self._cond:
+            if self._pid != os.getpid():
+                return True
+            target = self._appended
+            return self._cond.wait_for(lambda: self._durable >= target, timeout)
+
+    def _open(self):
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # a crash can leave a torn last line; start our first record on a fresh one
+        size = os.fstat(fd).st_size
+        if size:
+            with open(self.path, "rb") as f:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    os.write(fd, b"\n")
+        return fd
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+            # let concurrent rounds pile into the same batch
+            time.sleep(self.flush_interval)
+            with self._cond:
+                n = min(len(self._pending), self.batch)
+                events = [self._pending.popleft() for _ in range(n)]
+            data = "".join(json.dumps(ev, separators=(",", ":")) + "\n" for ev in events).encode()
+            while True:
+                try:
+                    run_in_os_thread(self._write, data)
+                    break
+                except OSError:
+                    self.errors += 1
+                    if self._fd is not None:
+                        os.close(self._fd)
+                        self._fd = None
+                    time.sleep(1.0)
+            with self._cond:
+                self._durable += n
+                self.written += n
+                self.batches += 1
+                self.bytes += len(data)
+                self._cond.notify_all()
+            self._since_checkpoint += len(data)
+            if self.checkpoint_bytes and self._since_checkpoint >= self.checkpoint_bytes \
+                    and not self._checkpointing:
+                self._since_checkpoint = 0
+                self._checkpointing = True
+                # the fold is pure CPU for seconds; on an OS thread the GIL still
+                # switches back to request handling every few ms (a greenlet never would)
+                start_os_thread(self._checkpoint, "event-log-checkpoint")
+
+    def _write(self, data):
+        """Put one batch on disk (blocking; called through run_in_os_thread)."""
+        if self._fd is None:
+            self._fd = self._open()
+        view = memoryview(data)
+        while view:  # os.write may accept only part of the batch
+            view = view[os.write(self._fd, view):]
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def _checkpoint(self):
+        try:
+            checkpoint_event_log(self.path)
+            self.checkpoints += 1
+        except OSError:
+            self.errors += 1
+        finally:
+            self._checkpointing = False
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "path": self.path,
+                "pending": len(self._pending),
+                "written": self.written,
+                "batches": self.batches,
+                "bytes": self.bytes,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "checkpoints": self.checkpoints,
+            }
+
+
+event_log = EventLog() if EVENT_LOG_PATH else None
+
+
+def log_game_start(game_id, state):
+    if event_log is not None:
+        state["start_logged"] = True  # exactly one start per epoch; export cursors rely on it
+        event_log.append({"type": "start", "game_id": game_id, "epoch": state["epoch"],
+                          "ts": time.time()})
+
+
+def log_round(game_id, state, entry):
+    if event_log is not None:
+        if entry["round"] == 1 and not state.get("start_logged"):
+            log_game_start(game_id, state)  # begun by /continue_simulation, not /start_simulation
+        event_log.append(dict(entry, type="round", game_id=game_id, epoch=state["epoch"],
+                              ts=time.time()))
+
+
+def read_events(path, offset=0, end=None):
+    """
+    Yield (offset, next_offset, event) for each complete line in
+    [offset, end), reading one line at a time. Torn or foreign lines are
+    skipped.
+    """
+    with open(path, "rb") as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        pos = offset
+        for line in f:
+            if pos + len(line) > end or not line.endswith(b"\n"):
+                break  # tail still being written
+            start, pos = pos, pos + len(line)
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and "game_id" in event:
+                yield start, pos, event
+
+
+def round_entry(event):
+    """The history entry stored in a round event."""
+    return {k: v for k, v in event.items() if k not in ("type", "game_id", "epoch", "ts")}
+
+
+def is_game_start(event, current):
+    """True if `event` starts an epoch other than `current`'s (a repeated start is a no-op)."""
+    return event.get("type") == "start" and (current is None or current["epoch"] != event.get("epoch"))
+
+
+def fold_events(states, path, offset=0):
+    """
+    Apply the log from `offset` to `states` (game_id -> (last_ts, state),
+    least recently played first). A start event with a new epoch begins a
+    fresh state; rounds that don't extend the current state by exactly one
+    are skipped. Returns the offset just past the last event applied.
+    """
+    pos = offset
+    for _, pos, ev in read_events(path, offset):
+        game_id, epoch, ts = ev["game_id"], ev.get("epoch"), ev.get("ts", 0)
+        state = states[game_id][1] if game_id in states else None
+        if is_game_start(ev, state):
+            state = dict(new_game_state(), epoch=epoch, start_logged=True)
+        elif ev.get("type") != "round" or state is None or state["epoch"] != epoch \
+                or ev.get("round") != state["round"] + 1:
+            continue
+        if ev.get("type") == "round":
+            commit_round(state, round_entry(ev))
+        states[game_id] = (ts, state)
+        states.move_to_end(game_id)
+        if len(states) > GAME_STORE_MAX_GAMES:
+            states.popitem(last=False)
+
+    cutoff = time.time() - GAME_STORE_TTL
+    while states and next(iter(states.values()))[0] < cutoff:
+        states.popitem(last=False)  # idle past the store TTL: would have expired anyway
+    return pos
+
+
+def load_checkpoint(path):
+    """(offset, states) from `path`.ckpt, or (0, empty) if missing or taken from another log file."""
+    try:
+        with open(path + ".ckpt", "rb") as f:
+            header = json.loads(f.readline())
+            log = os.stat(path)
+            if header["log_inode"] != log.st_ino or header["offset"] > log.st_size:
+                return 0, OrderedDict()
+            states = OrderedDict()
+            for line in f:
+                rec = json.loads(line)
+                if PROMPT_HISTORY == "full":
+                    history_text(rec["state"])  # left out by write_checkpoint
+                states[rec["game_id"]] = (rec["last_ts"], rec["state"])
+            return header["offset"], states
+    except (OSError, ValueError, KeyError):
+        return 0, OrderedDict()
+
+
+def write_checkpoint(path, offset, states):
+    tmp = f"{path}.ckpt.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(json.dumps({"offset": offset, "log_inode": os.stat(path).st_ino}) + "\n")
+        for game_id, (last_ts, state) in states.items():
+            # history_text is rebuilt on load; no need to store every round twice
+            if state.get("history_text"):
+                state = dict(state, history_text=None)
+            record = {"game_id": game_id, "last_ts": last_ts, "state": state}
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path + ".ckpt")
+
+
+def checkpoint_event_log(path=EVENT_LOG_PATH):
+    """
+    Fold the log written since the last checkpoint into a new one and
+    return the resulting states. Only one process rewrites the checkpoint
+    at a time; the others just fold and return.
+    """
+    with open(path + ".ckpt.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            owner = True
+        except BlockingIOError:
+            owner = False
+        offset, states = load_checkpoint(path)
+        end = fold_events(states, path, offset)
+        if owner and end > offset:
+            write_checkpoint(path, end, states)
+        return states
+
+
+def replay_event_log(path=EVENT_LOG_PATH, store=None):
+    """
+    Rebuild the games in `path` (checkpoint + the log after it) into
+    `store` (default: game_store). A game the store already holds in a
+    newer state is left alone (see the stores' `restore`). Returns the
+    number of games written.
+    """
+    store = game_store if store is None else store
+    if not path or not os.path.exists(path):
+        return 0
+    states = checkpoint_event_log(path)
+    return sum(store.restore(game_id, state, last_ts) for game_id, (last_ts, state) in states.items())
+
+
+_replayed_pid = None
+_replay_lock = threading.Lock()
+
+
+def replay_once():
+    """Replay the event log into this process's store, once per process (see EVENT_LOG_REPLAY)."""
+    global _replayed_pid
+    if _replayed_pid == os.getpid():
+        return
+    with _replay_lock:
+        if _replayed_pid != os.getpid():
+            # a shared SQLite store already holds every committed game (some not yet
+            # logged); only the in-process memory store starts out empty
+            if EVENT_LOG_REPLAY and event_log is not None and isinstance(game_store, MemoryGameStore):
+                replay_event_log(event_log.path)
+            _replayed_pid = os.getpid()
+
+
+def parse_export_cursor(cursor):
+    """"low:high" (or a bare offset, e.g. 0) -> (low, high); ValueError if malformed."""
+    low, _, high = str(cursor).partition(":")
+    low = int(low)
+    high = int(high) if high else low
+    if low < 0 or high < low:
+        raise ValueError(cursor)
+    return low, high
+
+
+def export_games(path, cursor="0", limit=1000, fields=None):
+    """
+    Yield games from the log in the order they closed, then a final
+    {"next_cursor": "low:high"}. A game closes when it reaches MAX_ROUNDS,
+    is restarted, or sees no round for GAME_STORE_TTL of log time; only
+    games still open are held in memory. `high` is where the previous page
+    stopped, `low` where the oldest game still open there began: the scan
+    restarts at `low` to rebuild those, and games that closed before
+    `high` were already sent. next_cursor equal to `cursor` means there
+    is nothing new yet.
+    """
+    low, high = parse_export_cursor(cursor)
+    end = os.path.getsize(path)
+    open_games = OrderedDict()  # game_id -> game, least recently played first
+    sent = 0
+
+    def record(game, reason):
+        return {
+            "game_id": game["game_id"],
+            "epoch": game["epoch"],
+            "started_at": game["started_at"],
+            "end": reason,
+            "round": len(game["rounds"]),
+            "am_total": sum(r["am_pay"] for r in game["rounds"]),
+            "mc_total": sum(r["mc_pay"] for r in game["rounds"]),
+            "history": history_view(game["rounds"], 0, fields),
+        }
+
+    pos = low
+    for offset, pos, ev in read_events(path, low, end):
+        game_id, epoch, ts = ev["game_id"], ev.get("epoch"), ev.get("ts", 0)
+        closed = []
+        while open_games:
+            idle = next(iter(open_games.values()))
+            if ts - idle["last_ts"] <= GAME_STORE_TTL:
+                break
+            closed.append((open_games.pop(idle["game_id"]), "expired"))
+
+        game = open_games.get(game_id)
+        if is_game_start(ev, game):
+            if game is not None:
+                closed.append((open_games.pop(game_id), "restarted"))
+            game = open_games[game_id] = {"game_id": game_id, "epoch": epoch, "offset": offset,
+                                          "started_at": ts, "last_ts": ts, "rounds": []}
+        elif ev.get("type") == "round" and game is not None and game["epoch"] == epoch \
+                and ev.get("round") == len(game["rounds"]) + 1:
+            game["rounds"].append(round_entry(ev))
+            game["last_ts"] = ts
+            open_games.move_to_end(game_id)
+            if len(game["rounds"]) >= MAX_ROUNDS:
+                closed.append((open_games.pop(game_id), "finished"))
+
+        if pos <= high:
+            continue  # this event's closings went out on an earlier page
+        for game, reason in closed:
+            if game["rounds"]:
+                sent += 1
+                yield record(game, reason)
+        if sent >= limit:
+            break
+
+    pos = max(pos, high)
+    start = min((game["offset"] for game in open_games.values()), default=pos)
+    yield {"next_cursor": f"{start}:{pos}"}
+
+
+if event_log is not None:
+    atexit.register(event_log.flush, 5.0)
+
+
+@app.before_request
+def _replay_event_log():
+    replay_once()
+
+
+# ============================================================
+# BATCH SIMULATION (headless, no LLM)
+# ============================================================
+#  Plays many full games at once: one NumPy array per state field, one
+#  vectorized draw per round across all games. advisor="none" uses the
+#  strategy alone; advisor="stub" blends in a balanced_strategy draw the
+#  same way decide_am_investment blends the LLM (fallback) suggestion.
+
+# /batch_simulate limits, so one request can't hold a worker past its timeout
+BATCH_MAX_GAMES = int(os.environ.get("BATCH_MAX_GAMES", "1000000"))
+BATCH_MAX_ROUNDS = int(os.environ.get("BATCH_MAX_ROUNDS", "1000"))  # each round is one Python-level pass
+BATCH_MAX_WORK = int(os.environ.get("BATCH_MAX_WORK", "20000000"))  # n_games * rounds * strategies
+BATCH_CHUNK = 250_000  # games per vectorized pass, bounds peak memory
+
+def batch_mc_policy(rng, vs):
+    return np.clip(12 + rng.integers(-4, 5, vs["n"]), 0, MAX_INVESTMENT)
+
+def batch_mc_mirror(rng, vs):
+    """Repeat AM's last move."""
+    if vs["round"] == 0:
+        return batch_mc_policy(rng, vs)
+    return vs["last_am"].copy()
+
+def batch_mc_best_response(rng, vs):
+    """Best reply to AM's last move."""
+    if vs["round"] == 0:
+        return batch_mc_policy(rng, vs)
+    return MC_BEST_RESPONSE[vs["last_am"]]
+
+def batch_mc_hawk(rng, vs):
+    return np.clip(20 + rng.integers(-3, 4, vs["n"]), 0, MAX_INVESTMENT)
+
+def batch_mc_dove(rng, vs):
+    return np.clip(5 + rng.integers(-2, 3, vs["n"]), 0, MAX_INVESTMENT)
+
+
+# "default" is decide_mc_investment's policy; the rest exist for tournaments
+BATCH_MC_POLICIES = {
+    "default": batch_mc_policy,
+    "mirror": batch_mc_mirror,
+    "best_response": batch_mc_best_response,
+    "hawk": batch_mc_hawk,
+    "dove": batch_mc_dove,
+}
+BATCH_ADVISORS = ("none", "stub")
+
+
+def _batch_chunk(rng, strategy_fn, mc_fn, n, rounds, advisor, strategy_weight):
+    vs = {
+        "n": n,
         "round": 0,
-        "history": [],
-        "am_total": 0,
-        "mc_total": 0,
-        "last_am": None,
-        "last_mc": None,
+        "am_total": np.zeros(n),
+        "mc_total": np.zeros(n),
+        "last_am": np.zeros(n, dtype=np.int64),
+        "last_mc": np.zeros(n, dtype=np.int64),
+    }
+    am_moves = 0
+    mc_moves = 0
+    for r in range(rounds):
+        vs["round"] = r
+        am = strategy_fn(rng, vs)
+        if advisor == "stub":
+            llm = batch_balanced(rng, vs)
+            am = np.clip(np.rint(am * strategy_weight + llm * (1 - strategy_weight)), 0, MAX_INVESTMENT).astype(np.int64)
+        mc = mc_fn(rng, vs)
+
+        am_pay, mc_pay = payoff_lookup(am, mc)
+        vs["am_total"] += am_pay
+        vs["mc_total"] += mc_pay
+        vs["last_am"] = am
+        vs["last_mc"] = mc
+        am_moves += am.sum()
+        mc_moves += mc.sum()
+    return vs["am_total"], vs["mc_total"], am_moves, mc_moves
+
+
+def _distribution(values):
+    p5, p25, p50, p75, p95 = np.percentile(values, [5, 25, 50, 75, 95])
+    return {
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "p5": float(p5),
+        "p25": float(p25),
+        "p50": float(p50),
+        "p75": float(p75),
+        "p95": float(p95),
+        "max": float(values.max()),
     }
-    return jsonify({"message": "Simulation started", "round": 0})
 
 
-@app.route("/continue_simulation", methods=["POST"])
-def continue_sim():
-    global game_state
+def batch_simulate(strategy="balanced", n_games=10_000, rounds=MAX_ROUNDS, seed=None,
+                   advisor="none", strategy_weight=STRATEGY_WEIGHT, mc_policy="default"):
+    """
+    Play `n_games` full games of `strategy` against `mc_policy` (by default
+    decide_mc_investment's) and return aggregate payoff distributions and
+    win rates. Same seed, same arguments -> same result.
+    """
+    if strategy not in AM_STRATEGIES:
+        raise ValueError(f"unknown strategy: {strategy!r}")
+    if mc_policy not in BATCH_MC_POLICIES:
+        raise ValueError(f"unknown mc_policy: {mc_policy!r}")
+    if advisor not in BATCH_ADVISORS:
+        raise ValueError(f"unknown advisor: {advisor!r}")
+    if n_games < 1 or rounds < 1:
+        raise ValueError("n_games and rounds must be positive")
+
+    rng = np.random.default_rng(seed)
+    strategy_fn = AM_STRATEGIES[strategy].batch
+    am_parts, mc_parts = [], []
+    am_moves = mc_moves = 0
+    for start in range(0, n_games, BATCH_CHUNK):
+        n = min(BATCH_CHUNK, n_games - start)
+        am_total, mc_total, am_sum, mc_sum = _batch_chunk(
+            rng, strategy_fn, BATCH_MC_POLICIES[mc_policy], n, rounds, advisor, strategy_weight
+        )
+        am_parts.append(am_total)
+        mc_parts.append(mc_total)
+        am_moves += am_sum
+        mc_moves += mc_sum
+
+    am_total = np.concatenate(am_parts)
+    mc_total = np.concatenate(mc_parts)
+    return {
+        "strategy": strategy,
+        "mc_policy": mc_policy,
+        "advisor": advisor,
+        "strategy_weight": strategy_weight,
+        "n_games": n_games,
+        "rounds": rounds,
+        "seed": seed,
+        "am_total": _distribution(am_total),
+        "mc_total": _distribution(mc_total),
+        "am_win_rate": float((am_total > mc_total).mean()),
+        "mc_win_rate": float((am_total < mc_total).mean()),
+        "tie_rate": float((am_total == mc_total).mean()),
+        "am_mean_move": float(am_moves) / (n_games * rounds),
+        "mc_mean_move": float(mc_moves) / (n_games * rounds),
+    }
 
-    if game_state["round"] >= MAX_ROUNDS:
-        return jsonify({"finished": True, "history": game_state["history"]})
 
-    data = request.json or {}
-    strategy_name = data.get("strategy", "balanced")
+# ============================================================
+# ENDPOINTS
+# ============================================================
 
-    am_inv, reasoning = decide_am_investment(game_state, strategy_name)
-    mc_inv = decide_mc_investment(game_state)
+@app.route("/start_simulation", methods=["POST"])
+def start_sim():
+    data = request.get_json(silent=True) or {}
+    game_id = explicit_game_id(data) or cookie_game_id()
+    issue_cookie = game_id is None and bool(GAME_COOKIE)
+    if issue_cookie:
+        game_id = uuid.uuid4().hex  # old front-end, first game in this browser
+    game_id = game_id or DEFAULT_GAME_ID
+    prefetcher.cancel(game_id)
+    game_state = new_game_state()
+    log_game_start(game_id, game_state)
+    game_store.save(game_id, game_state)
+    resp = jsonify({"message": "Simulation started", "round": 0, "game_id": game_id})
+    if issue_cookie:
+        set_game_cookie(resp, game_id)
+    return resp
 
-    am_pay, mc_pay = compute_payoff(am_inv, mc_inv)
 
-    game_state["am_total"] += am_pay
-    game_state["mc_total"] += mc_pay
-    game_state["last_am"] = am_inv
-    game_state["last_mc"] = mc_inv
+ROUND_CONFLICT_MESSAGE = "another request played or restarted this game first; reload it and retry"
 
-    game_state["history"].append({
-        "round": game_state["round"] + 1,
-        "am": am_inv,
-        "mc": mc_inv,
-        "am_pay": am_pay,
-        "mc_pay": mc_pay,
-        "am_reasoning": reasoning,  # list[str] with persona reasoning
-    })
 
-    game_state["round"] += 1
+@app.route("/continue_simulation", methods=["POST"])
+def continue_sim():
+    data = request.get_json(silent=True) or {}
+    game_id = request_game_id(data)
+    try:
+        since_round, fields, tag_epoch = delta_params(data, game_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with timed("store_load"):
+        game_state = load_game(game_id, since_round)
+        if tag_epoch is not None and tag_epoch != game_state["epoch"]:
+            since_round = 0  # the tag predates a restart: send the new game in full
+            game_state = load_game(game_id)
 
-    return jsonify({
-        "finished": game_state["round"] >= MAX_ROUNDS,
-        "round": game_state["round"],
-        "history": game_state["history"],
-        "am_total": game_state["am_total"],
-        "mc_total": game_state["mc_total"]
-    })
+    if game_state["round"] >= MAX_ROUNDS:
+        resp = jsonify({
+            "finished": True,
+            "history": history_view(game_state["history"], since_round, fields),
+            "game_id": game_id,
+        })
+        resp.headers["ETag"] = history_etag(game_id, game_state)
+        return resp
 
+    strategy_name = data.get("strategy", "balanced")
+    entry = play_round(game_state, strategy_name, prefetcher.take(game_id, game_state))
+    with timed("store_save"):
+        try:
+            game_store.commit(game_id, game_state, entry)
+        except RoundConflict:
+            return jsonify({"error": ROUND_CONFLICT_MESSAGE, "game_id": game_id}), 409
+        log_round(game_id, game_state, entry)
+    prefetcher.start(game_id, game_state)
+
+    with timed("serialize"):
+        resp = jsonify({
+            "finished": game_state["round"] >= MAX_ROUNDS,
+            "round": game_state["round"],
+            "history": history_view(game_state["history"], since_round, fields),
+            "am_total": game_state["am_total"],
+            "mc_total": game_state["mc_total"],
+            "game_id": game_id,
+        })
+    resp.headers["ETag"] = history_etag(game_id, game_state)
+    return resp
+
+
+@app.route("/run_simulation", methods=["POST"])
+def run_simulation():
+    """
+    Play every remaining round of a game server-side and stream each one as
+    soon as it is committed, as NDJSON (default) or SSE (`"format": "sse"`).
+    The next round's advisor call is sent before the current event is
+    yielded, so it overlaps with flushing it to the client. If another
+    request commits a round of the same game first, an "error" event ends
+    the stream.
+    """
+    data = request.get_json(silent=True) or {}
+    game_id = request_game_id(data)
+    strategy_name = data.get("strategy", "balanced")
+    try:
+        fields = request_fields(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fmt = data.get("format", "ndjson")
+    if fmt not in ("ndjson", "sse"):
+        return jsonify({"error": "format must be 'ndjson' or 'sse'"}), 400
+
+    game_state = load_game(game_id, since_round=None)  # streams rounds, never the history
+
+    def encode(payload, event):
+        if fmt == "sse":
+            return sse_event(payload, event)
+        return json.dumps(dict(payload, event=event)) + "\n"
+
+    def generate():
+        advisor = prefetcher.take(game_id, game_state)
+        try:
+            while game_state["round"] < MAX_ROUNDS:
+                entry = play_round(game_state, strategy_name, advisor)
+                try:
+                    game_store.commit(game_id, game_state, entry)
+                except RoundConflict:
+                    yield encode({"error": ROUND_CONFLICT_MESSAGE, "game_id": game_id}, "error")
+                    return
+                log_round(game_id, game_state, entry)
+                advisor = None
+                if game_state["round"] < MAX_ROUNDS:
+                    advisor = submit_advisor(game_state)
+                yield encode({
+                    "round": game_state["round"],
+                    "entry": history_view([entry], 0, fields)[0],
+                    "am_total": game_state["am_total"],
+                    "mc_total": game_state["mc_total"],
+                }, "round")
+            yield encode({
+                "finished": True,
+                "round": game_state["round"],
+                "am_total": game_state["am_total"],
+                "mc_total": game_state["mc_total"],
+                "game_id": game_id,
+            }, "done")
+        finally:
+            # client went away mid-game: drop the call nobody will read
+            if advisor is not None:
+                advisor.cancel()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream" if fmt == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@app.route("/chat_with_agent", methods=["POST"])
-def chat_with_agent():
-    data = request.json or {}
-    user_msg = data.get("message", "")
 
+def chat_persona(game_state):
     # 根据当前 strategy 输出对应 persona 语气
     if game_state["history"]:
         last_round = game_state["history"][-1]
@@ -365,9 +2459,11 @@ def chat_with_agent():
         current_strategy = "balanced"
 
     persona_info = PERSONA_PROFILES.get(current_strategy, PERSONA_PROFILES["balanced"])
-    persona_name = persona_info["name"]
+    return persona_info["name"]
 
-    prompt = f"""
+
+def chat_prompt(persona_name, user_msg):
+    return f"""
 You are the AM agent in a repeated investment game.
 Your persona is **{persona_name}**.
 User says: {user_msg}
@@ -375,21 +2471,209 @@ User says: {user_msg}
 Reply in 1–2 sentences, staying in character as {persona_name}.
 """
 
+
+def chat_fallback(persona_name):
+    return f"As {persona_name}, I hear you. Let's see how the next round plays out."
+
+
+def sse_event(data, event=None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data)}\n\n"
+
+
+@app.route("/chat_with_agent", methods=["POST"])
+def chat_with_agent():
+    data = request.get_json(silent=True) or {}
+    user_msg = data.get("message", "")
+    persona_name = chat_persona(load_game(request_game_id(data), since_round=None))
+    prompt = chat_prompt(persona_name, user_msg)
+
     try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
+        resp = llm_call(
+            model=LLM_MODEL,
             messages=[{"role": "user", "content": prompt}]
         )
         reply = resp.choices[0].message.content
-    except Exception:
-        reply = f"As {persona_name}, I hear you. Let's see how the next round plays out."
+    except Exception as e:
+        LLM_FALLBACKS.inc(1, "chat", fallback_reason(e))
+        reply = chat_fallback(persona_name)
 
     return jsonify({"reply": reply})
 
 
-# ============================================================
-# RUN
-# ============================================================
+@app.route("/chat_with_agent/stream", methods=["POST"])
+def chat_with_agent_stream():
+    """
+    SSE variant of /chat_with_agent. Emits one `data: {"delta": ...}` per
+    token chunk, then `event: done` with the full reply. If the model fails,
+    even mid-stream, a `fallback` event carries the persona reply the client
+    should show instead of what it has so far.
+    """
+    data = request.get_json(silent=True) or {}
+    user_msg = data.get("message", "")
+    persona_name = chat_persona(load_game(request_game_id(data), since_round=None))
+    prompt = chat_prompt(persona_name, user_msg)
+
+    def generate():
+        parts = []
+        stream = None
+        try:
+            stream = llm_call(
+                model=LLM_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                if chunk.usage is not None:
+                    LLM_TOKENS.inc(chunk.usage.prompt_tokens, "prompt")
+                    LLM_TOKENS.inc(chunk.usage.completion_tokens, "completion")
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield sse_event({"delta": delta})
+            reply = "".join(parts)
+        except Exception as e:
+            if stream is not None:
+                # llm_call only sees errors raised before the first chunk
+                breaker.record_failure()
+            LLM_FALLBACKS.inc(1, "chat_stream", fallback_reason(e))
+            reply = chat_fallback(persona_name)
+            yield sse_event({"reply": reply}, event="fallback")
+        yield sse_event({"reply": reply}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/batch_simulate", methods=["POST"])
+def batch_simulate_endpoint():
+    data = request.get_json(silent=True) or {}
+    strategies = data.get("strategies") or [data.get("strategy", "balanced")]
+    seed = data.get("seed")
+    try:
+        n_games = int(data.get("n_games", 10_000))
+        rounds = int(data.get("rounds", MAX_ROUNDS))
+        if not isinstance(strategies, list) or not all(isinstance(name, str) for name in strategies):
+            raise ValueError("strategies must be a list of strategy names")
+        if len(set(strategies)) != len(strategies):
+            raise ValueError("strategies must not repeat")
+        if n_games > BATCH_MAX_GAMES:
+            raise ValueError(f"n_games is capped at {BATCH_MAX_GAMES}")
+        if rounds > BATCH_MAX_ROUNDS:
+            raise ValueError(f"rounds is capped at {BATCH_MAX_ROUNDS}")
+        if n_games * rounds * len(strategies) > BATCH_MAX_WORK:
+            raise ValueError(f"n_games * rounds * len(strategies) is capped at {BATCH_MAX_WORK}")
+        started = time.perf_counter()
+        results = [
+            batch_simulate(name, n_games, rounds, seed, data.get("advisor", "none"),
+                           float(data.get("strategy_weight", STRATEGY_WEIGHT)),
+                           data.get("mc_policy", "default"))
+            for name in strategies
+        ]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "results": results,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "llm_cache": suggestion_cache.stats(),
+        "llm_breaker": breaker.snapshot(),
+        "llm_retry_budget": retry_budget.snapshot(),
+        "advisor_prefetch_pending": len(prefetcher),
+        "event_log": event_log.snapshot() if event_log is not None else None,
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    cache = suggestion_cache.stats()
+    lines = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, LLM_TOKENS, LLM_FALLBACKS, PREFETCH_EVENTS):
+        lines += metric.render()
+    lines += sample_lines("backend7_active_sessions", "Games held by the game store.", "gauge",
+                          [({}, len(game_store))])
+    lines += sample_lines("backend7_llm_cache_entries", "Suggestions in the in-memory cache.", "gauge",
+                          [({}, cache["size"])])
+    lines += sample_lines("backend7_llm_cache_lookups_total", "Suggestion cache lookups.", "counter",
+                          [({"result": "hit"}, cache["hits"] - cache["disk_hits"]),
+                           ({"result": "disk_hit"}, cache["disk_hits"]),
+                           ({"result": "miss"}, cache["misses"])])
+    circuit = breaker.snapshot()
+    lines += sample_lines("backend7_llm_circuit_state", "1 for the breaker's current state.", "gauge",
+                          [({"state": st}, int(circuit["state"] == st))
+                           for st in ("closed", "open", "half_open")])
+    lines += sample_lines("backend7_llm_circuit_events_total", "Breaker outcomes.", "counter",
+                          [({"event": ev}, circuit[ev])
+                           for ev in ("successes", "failures", "rejected", "times_opened")])
+    lines += sample_lines("backend7_llm_retry_budget_tokens", "Retries currently affordable.", "gauge",
+                          [({}, retry_budget.snapshot()["tokens"])])
+    if event_log is not None:
+        elog = event_log.snapshot()
+        lines += sample_lines("backend7_event_log_pending", "Events queued for the log writer.", "gauge",
+                              [({}, elog["pending"])])
+        lines += sample_lines("backend7_event_log_events_total", "Event log outcomes.", "counter",
+                              [({"result": "written"}, elog["written"]),
+                               ({"result": "dropped"}, elog["dropped"])])
+        lines += sample_lines("backend7_event_log_batches_total", "Group-commit writes.", "counter",
+                              [({}, elog["batches"])])
+        lines += sample_lines("backend7_event_log_write_errors_total", "Failed log writes (retried).",
+                              "counter", [({}, elog["errors"])])
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/metrics/profile", methods=["GET"])
+def metrics_profile():
+    try:
+        limit = max(1, int(request.args.get("limit", 40)))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    with _profile_lock:
+        if _profile_stats is None:
+            return Response("no samples (set PROFILE_SAMPLE_RATE > 0)\n", mimetype="text/plain")
+        out = io.StringIO()
+        _profile_stats.stream = out
+        _profile_stats.sort_stats("cumulative").print_stats(limit)
+    return Response(out.getvalue(), mimetype="text/plain")
+
+
+@app.route("/export", methods=["GET"])
+def export():
+    """
+    Closed games from the event log as NDJSON, in the order they closed,
+    one game per line, streamed as the log is read. Page with ?cursor= (the last line's
+    next_cursor) and ?limit=; ?fields= trims each round as in /continue_simulation.
+    """
+    if event_log is None:
+        return jsonify({"error": "event log disabled (set EVENT_LOG_PATH)"}), 404
+    cursor = request.args.get("cursor", "0")
+    try:
+        parse_export_cursor(cursor)
+        limit = max(1, min(EXPORT_MAX_LIMIT, int(request.args.get("limit", 1000))))
+    except ValueError:
+        return jsonify({"error": "cursor must be a next_cursor value and limit an integer"}), 400
+    fields = request_fields(request.args)
+    if not os.path.exists(event_log.path):
+        return Response(json.dumps({"next_cursor": cursor}) + "\n", mimetype="application/x-ndjson")
+
+    def generate():
+        for record in export_games(event_log.path, cursor, limit, fields):
+            yield json.dumps(record) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 @app.route("/")
 def home():
@@ -0,0 +1,87 @@
+# ============================================================
+#  Shared helpers for the bench/ scripts: latency summaries,
+#  JSON result files and regression checks against a baseline.
+# ============================================================
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# repo root on sys.path so `import backend7` works from bench/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def isolate_event_log():
+    """
+    Point backend7's event log at a fresh temp file and disable replay, so a
+    benchmark neither replays nor appends to a log a real server uses, and
+    the log is on for it. Call before importing backend7; returns the log path.
+    """
+    path = os.path.join(tempfile.mkdtemp(prefix="b7-bench-"), "game_events.jsonl")
+    os.environ["EVENT_LOG_PATH"] = path
+    os.environ["EVENT_LOG_REPLAY"] = "0"
+    return path
+
+
+# latency histogram bucket upper bounds, milliseconds
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def summarize_latencies(seconds):
+    """count / mean / percentiles / histogram for a list of latencies in seconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    if ms.size == 0:
+        return {"count": 0}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    counts = np.histogram(ms, bins=[0.0] + HISTOGRAM_BOUNDS_MS + [np.inf])[0]
+    labels = [f"<={b}ms" for b in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p90_ms": round(float(p90), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "histogram": dict(zip(labels, counts.tolist())),
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_results(results, path):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def check_regressions(current, baseline_path, metric, tolerance):
+    """
+    Compare `metric` of every named entry in current["results"] with the
+    baseline file (larger = slower). Returns the list of regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for name, entry in current["results"].items():
+        old = baseline.get(name, {}).get(metric)
+        new = entry.get(metric)
+        if old and new and new > old * (1 + tolerance):
+            regressions.append(f"{name}: {metric} {old} -> {new} (+{(new / old - 1) * 100:.1f}%)")
+    return regressions
@@ -0,0 +1,243 @@
+# ============================================================
+#  Consistency checks for the event log and game stores (not timings):
+#    export   paging /export's "low:high" cursor over a randomized log,
+#             appended to (torn last line included) between pages,
+#             yields exactly the games of one full export, in order
+#    replay   checkpoint + tail rebuilds the live games exactly, as does
+#             a replay of the whole log; replay never rolls a SQLite
+#             game back past rounds that were committed but not logged
+#    cas      threads committing the same round: one winner, the rest
+#             RoundConflict, on the memory and SQLite stores
+#  Randomized but seeded; prints one line per check, exit 1 on failure.
+#
+#    python bench/consistency.py
+#    python bench/consistency.py --seed 7 --steps 20000
+# ============================================================
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from common import isolate_event_log
+from fake_openai import start_fake_openai
+
+TMP = os.path.dirname(isolate_event_log())
+os.environ["GAME_STORE"] = "memory"
+os.environ["PREFETCH"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+
+STATE_KEYS = ("epoch", "round", "history", "history_text", "stats",
+              "am_total", "mc_total", "last_am", "last_mc")
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(ok, message):
+    if not ok:
+        raise CheckFailed(message)
+
+
+def random_events(backend7, rng, games, steps):
+    """
+    A log as live servers write it, plus the noise replay and export must
+    skip: repeated starts, stale or duplicate rounds, rounds past
+    MAX_ROUNDS, games idle past GAME_STORE_TTL. Timestamps are synthetic.
+    """
+    ts = 1_000_000.0
+    live = {}  # game_id -> [epoch, round]
+    for _ in range(steps):
+        ts += rng.expovariate(1.0)
+        if rng.random() < 0.002:
+            ts += backend7.GAME_STORE_TTL * 2  # everything open goes idle
+        game_id = f"g{rng.randrange(games)}"
+        game = live.get(game_id)
+        if game is None or rng.random() < 0.04:
+            game = live[game_id] = [f"{rng.getrandbits(64):016x}", 0]
+            yield {"type": "start", "game_id": game_id, "epoch": game[0], "ts": ts}
+            if rng.random() < 0.05:
+                yield {"type": "start", "game_id": game_id, "epoch": game[0], "ts": ts}
+            continue
+        round_idx = game[1] if rng.random() < 0.03 else game[1] + 1  # a stale duplicate now and then
+        game[1] = max(game[1], round_idx)
+        am, mc = rng.randrange(25), rng.randrange(25)
+        am_pay, mc_pay = backend7.compute_payoff(am, mc)
+        yield {"round": round_idx, "am": am, "mc": mc, "am_pay": am_pay, "mc_pay": mc_pay,
+               "am_reasoning": [f"step {round_idx}"], "type": "round", "game_id": game_id,
+               "epoch": game[0], "ts": ts}
+
+
+def check_export(backend7, rng, games, steps):
+    path = os.path.join(TMP, "export.jsonl")
+    lines = [json.dumps(ev) + "\n" for ev in random_events(backend7, rng, games, steps)]
+    cursor, paged, pages = "0", [], 0
+
+    def drain():
+        nonlocal cursor, pages
+        while True:
+            page = list(backend7.export_games(path, cursor, rng.randint(1, 8)))
+            paged.extend(page[:-1])
+            pages += 1
+            if page[-1]["next_cursor"] == cursor:
+                return
+            cursor = page[-1]["next_cursor"]
+
+    with open(path, "w") as f:
+        i = 0
+        while i < len(lines):
+            chunk = lines[i:i + rng.randint(1, 400)]
+            i += len(chunk)
+            f.write("".join(chunk[:-1]))
+            cut = rng.randrange(1, len(chunk[-1]))
+            f.write(chunk[-1][:cut])  # the writer is mid-line while we page
+            f.flush()
+            drain()
+            f.write(chunk[-1][cut:])
+            f.flush()
+            drain()
+
+    full = list(backend7.export_games(path, "0", 10 ** 9))[:-1]
+    expect(len(full) > 0, "the random log closed no games")
+    expect(paged == full, f"paged export has {len(paged)} games, full export {len(full)}, or order differs")
+    return f"{len(full)} games over {pages} pages"
+
+
+def live_states(backend7, game_ids):
+    return {game_id: backend7.game_store.load(game_id) for game_id in game_ids}
+
+
+def same_games(expected, store, label):
+    for game_id, state in expected.items():
+        got = store.load(game_id)
+        expect(got is not None, f"{label}: {game_id} missing")
+        for key in STATE_KEYS:
+            expect(got.get(key) == state.get(key), f"{label}: {game_id} differs in {key!r}")
+
+
+def play(backend7, client, rng, game_ids, requests):
+    for _ in range(requests):
+        game_id = rng.choice(game_ids)
+        if rng.random() < 0.1:
+            client.post("/start_simulation", json={"game_id": game_id})
+        else:  # a game begun by /continue_simulation logs its own start
+            client.post("/continue_simulation", json={"game_id": game_id, "since_round": 10 ** 6})
+
+
+def check_replay(backend7, rng, games, requests):
+    client = backend7.app.test_client()
+    log = backend7.event_log
+    game_ids = [f"r{i}" for i in range(games)]
+
+    play(backend7, client, rng, game_ids, requests)
+    log.flush()
+    backend7.checkpoint_event_log(log.path)
+    offset, _ = backend7.load_checkpoint(log.path)
+    expect(offset > 0, "no checkpoint was written")
+    play(backend7, client, rng, game_ids, requests)
+    log.flush()
+    expected = {k: v for k, v in live_states(backend7, game_ids).items() if v is not None}
+
+    store = backend7.MemoryGameStore()
+    backend7.replay_event_log(log.path, store)
+    same_games(expected, store, "checkpoint + tail")
+
+    os.remove(log.path + ".ckpt")
+    store = backend7.MemoryGameStore()
+    backend7.replay_event_log(log.path, store)
+    same_games(expected, store, "whole log")
+
+    sqlite = backend7.SQLiteGameStore(os.path.join(TMP, "replay.db"))
+    expect(backend7.replay_event_log(log.path, sqlite) == len(expected), "SQLite replay skipped games")
+    same_games(expected, sqlite, "SQLite")
+    # a round committed by another worker but not yet in the log must survive replay
+    game_id = next(g for g, st in expected.items() if st["round"] < backend7.MAX_ROUNDS)
+    state = sqlite.load(game_id)
+    entry = backend7.play_round(state, "balanced")
+    sqlite.commit(game_id, state, entry)
+    expect(backend7.replay_event_log(log.path, sqlite) == 0, "replay rewrote up-to-date SQLite games")
+    expect(sqlite.load(game_id)["round"] == entry["round"], "replay rolled a SQLite game back")
+    return f"{len(expected)} games, checkpoint at byte {offset} of {os.path.getsize(log.path)}"
+
+
+def race(backend7, store, game_id, contenders):
+    """`contenders` threads load the game, play the same next round and commit at once."""
+    barrier = threading.Barrier(contenders)
+
+    def contender(i):
+        state = store.load(game_id)
+        entry = {"round": state["round"] + 1, "am": i, "mc": 12, "am_pay": 1.0, "mc_pay": 1.0,
+                 "am_reasoning": []}
+        backend7.commit_round(state, entry)
+        barrier.wait()
+        try:
+            store.commit(game_id, state, entry)
+            return "won"
+        except backend7.RoundConflict:
+            return "conflict"
+
+    with ThreadPoolExecutor(contenders) as pool:
+        return list(pool.map(contender, range(contenders)))
+
+
+def check_cas(backend7, rounds, contenders):
+    out = []
+    stores = (("memory", backend7.MemoryGameStore()),
+              ("sqlite", backend7.SQLiteGameStore(os.path.join(TMP, "cas.db"))))
+    for name, store in stores:
+        store.save("cas", backend7.new_game_state())
+        for r in range(1, rounds + 1):
+            results = race(backend7, store, "cas", contenders)
+            expect(results.count("won") == 1, f"{name}: round {r} had {results.count('won')} winners")
+            expect(store.load("cas")["round"] == r, f"{name}: round {r} not stored")
+        stale = store.load("cas")
+        store.save("cas", backend7.new_game_state())  # a restart wins over the old epoch
+        entry = {"round": stale["round"] + 1, "am": 0, "mc": 0, "am_pay": 0.0, "mc_pay": 0.0,
+                 "am_reasoning": []}
+        try:
+            store.commit("cas", stale, entry)
+            raise CheckFailed(f"{name}: a commit on a restarted game went through")
+        except backend7.RoundConflict:
+            pass
+        out.append(f"{name} {rounds}x{contenders}")
+    return ", ".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="event log and game store consistency checks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--games", type=int, default=40)
+    parser.add_argument("--steps", type=int, default=5000, help="events in the export log")
+    parser.add_argument("--requests", type=int, default=150, help="requests per replay phase")
+    parser.add_argument("--contenders", type=int, default=8)
+    args = parser.parse_args()
+
+    server, base_url = start_fake_openai(latency=0.0, jitter=0.0)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    import backend7
+
+    checks = (
+        ("export", lambda: check_export(backend7, random.Random(args.seed), args.games, args.steps)),
+        ("replay", lambda: check_replay(backend7, random.Random(args.seed), args.games, args.requests)),
+        ("cas", lambda: check_cas(backend7, backend7.MAX_ROUNDS, args.contenders)),
+    )
+    failed = 0
+    for name, check in checks:
+        started = time.perf_counter()
+        try:
+            detail = check()
+            print(f"ok    {name}: {detail} ({time.perf_counter() - started:.1f}s)")
+        except CheckFailed as e:
+            failed += 1
+            print(f"FAIL  {name}: {e}")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+# ============================================================
+#  Event log benchmarks: raw group-commit throughput of EventLog, and
+#  /continue_simulation latency with the log on vs off (OpenAI replaced
+#  by bench/fake_openai.py), to show logging stays off the round path.
+#  loop_lag[...] entries time a 1 ms sleep loop while the writer or a
+#  checkpoint runs: how long a request on the same worker would stall.
+#  --gevent monkey-patches first, like GUNICORN_WORKER_CLASS=gevent, so
+#  the numbers cover the event loop, not just OS threads.
+#
+#    python bench/eventlog.py --threads 8 --events 20000 --out eventlog.json
+#    python bench/eventlog.py --gevent --out eventlog-gevent.json
+#    python bench/eventlog.py --baseline eventlog.json   # exit 1 on p99 regression
+# ============================================================
+
+import sys
+
+if "--gevent" in sys.argv:
+    from gevent import monkey
+
+    monkey.patch_all()
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import threading
+import time
+import uuid
+
+from common import check_regressions, environment, isolate_event_log, summarize_latencies, write_results
+from fake_openai import start_fake_openai
+
+TMP = os.path.dirname(isolate_event_log())
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+
+
+def sample_entry(round_idx):
+    return {
+        "round": round_idx,
+        "am": 13,
+        "mc": 12,
+        "am_pay": 302.0,
+        "mc_pay": 244.0,
+        "am_reasoning": ["Strategy persona: Pragmatic Optimizer"] * 6,
+    }
+
+
+def bench_writer(backend7, threads, events, fsync):
+    """Append `events` rounds from `threads` threads; time each append and the drain to disk."""
+    log = backend7.EventLog(os.path.join(TMP, f"writer-{fsync}.jsonl"), fsync=fsync)
+    state = {"epoch": uuid.uuid4().hex, "start_logged": True}
+    per_thread = events // threads
+
+    def worker(_):
+        out = []
+        for i in range(per_thread):
+            event = dict(sample_entry(i % 10 + 1), type="round", game_id="g", epoch=state["epoch"],
+                         ts=time.time())
+            t0 = time.perf_counter()
+            log.append(event)
+            out.append(time.perf_counter() - t0)
+        return out
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        latencies = [s for chunk in pool.map(worker, range(threads)) for s in chunk]
+    log.flush()
+    elapsed = time.perf_counter() - started
+    snap = log.snapshot()
+    return dict(
+        summarize_latencies(latencies),
+        events_per_s=round(snap["written"] / elapsed, 1),
+        batches=snap["batches"],
+        events_per_batch=round(snap["written"] / max(1, snap["batches"]), 1),
+        bytes=snap["bytes"],
+    )
+
+
+def loop_lag(fn):
+    """
+    Run fn() while a ticker sleeps 1 ms at a time; returns fn's result and
+    each tick's overshoot in seconds. Under --gevent the ticker is a
+    greenlet, so the overshoot is how long the event loop was blocked.
+    """
+    lags = []
+    done = threading.Event()
+
+    def tick():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            time.sleep(0.001)
+            lags.append(time.perf_counter() - t0 - 0.001)
+
+    ticker = threading.Thread(target=tick)
+    ticker.start()
+    try:
+        result = fn()
+    finally:
+        done.set()
+        ticker.join()
+    return result, lags
+
+
+def bench_checkpoint(backend7, games):
+    """Fold a log of `games` full games into a checkpoint on an OS thread, as EventLog does."""
+    path = os.path.join(TMP, "checkpoint.jsonl")
+    log = backend7.EventLog(path, fsync=False, checkpoint_bytes=0)
+    for g in range(games):
+        epoch = uuid.uuid4().hex
+        log.append({"type": "start", "game_id": f"g{g}", "epoch": epoch, "ts": time.time()})
+        for r in range(1, backend7.MAX_ROUNDS + 1):
+            log.append(dict(sample_entry(r), type="round", game_id=f"g{g}", epoch=epoch, ts=time.time()))
+    log.flush()
+    finished = []
+
+    def checkpoint():
+        t0 = time.perf_counter()
+        backend7.checkpoint_event_log(path)
+        finished.append(time.perf_counter() - t0)
+
+    def run():
+        backend7.start_os_thread(checkpoint, "bench-checkpoint")
+        while not finished:  # poll: a threading.Event set from an OS thread isn't gevent-safe
+            time.sleep(0.005)
+        return finished[0]
+
+    seconds, lags = loop_lag(run)
+    return dict(summarize_latencies(lags), log_bytes=os.path.getsize(path), fold_s=round(seconds, 3))
+
+
+def bench_round_path(backend7, users, games):
+    """Per-request /continue_simulation latency for `users` concurrent players."""
+    client = backend7.app.test_client()
+
+    def player(_):
+        out = []
+        for _ in range(games):
+            game_id = uuid.uuid4().hex
+            client.post("/start_simulation", json={"game_id": game_id})
+            for _ in range(backend7.MAX_ROUNDS):
+                t0 = time.perf_counter()
+                client.post("/continue_simulation", json={"game_id": game_id, "since_round": 0})
+                out.append(time.perf_counter() - t0)
+        return out
+
+    with ThreadPoolExecutor(users) as pool:
+        return [s for chunk in pool.map(player, range(users)) for s in chunk]
+
+
+def run(threads, events, users, games, checkpoint_games):
+    server, base_url = start_fake_openai(latency=0.0, jitter=0.0)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    import backend7
+
+    results = {}
+    for fsync in (True, False):
+        results[f"append[fsync={int(fsync)}]"] = bench_writer(backend7, threads, events, fsync)
+    _, lags = loop_lag(lambda: bench_writer(backend7, threads, events, True))
+    results["loop_lag[append fsync=1]"] = summarize_latencies(lags)
+    results["loop_lag[checkpoint]"] = bench_checkpoint(backend7, checkpoint_games)
+
+    backend7.PREFETCH = False  # every round waits on its own advisor call, like a cold request
+    bench_round_path(backend7, users, 1)  # warm up connections and code paths
+    enabled = backend7.event_log
+    for label, log in (("off", None), ("on", enabled)):
+        backend7.event_log = log
+        results[f"continue_simulation[log={label}]"] = summarize_latencies(
+            bench_round_path(backend7, users, games))
+    backend7.event_log = enabled
+    enabled.flush()
+    results["continue_simulation[log=on]"]["log"] = enabled.snapshot()
+
+    server.shutdown()
+    return {
+        "environment": environment(),
+        "params": {"threads": threads, "events": events, "users": users, "games": games,
+                   "checkpoint_games": checkpoint_games, "gevent": "gevent.monkey" in sys.modules},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="event log throughput and round-path overhead")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--games", type=int, default=5)
+    parser.add_argument("--checkpoint-games", type=int, default=5000)
+    parser.add_argument("--gevent", action="store_true", help="monkey-patch with gevent first")
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args.threads, args.events, args.users, args.games, args.checkpoint_games)
+    write_results(results, args.out)
+
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "p99_ms", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
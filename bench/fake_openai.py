@@ -0,0 +1,144 @@
+# ============================================================
+#  Local stand-in for the OpenAI chat-completions API
+#  POST /v1/chat/completions  (plain JSON and stream=True SSE)
+#  Latency, jitter and error rate are configurable so benchmarks can
+#  reproduce a fast, slow or flaky upstream without spending API money.
+#
+#    python bench/fake_openai.py --port 8089 --latency 0.3 --jitter 0.1 --error-rate 0.05
+#    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake gunicorn ...
+# ============================================================
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import threading
+import time
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(length) or b"{}")
+        cfg = self.server.config
+
+        with cfg["lock"]:
+            cfg["requests"] += 1
+        time.sleep(max(0.0, random.gauss(cfg["latency"], cfg["jitter"])))
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        if random.random() < cfg["error_rate"]:
+            with cfg["lock"]:
+                cfg["errors"] += 1
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        prompt = "".join(m.get("content", "") for m in req.get("messages", []))
+        content = str(random.randint(0, 25)) if "ONE integer" in prompt else "Steady as we go — I'm watching MC closely."
+        model = req.get("model", "gpt-4o-mini")
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": max(1, len(content) // 4),
+            "total_tokens": len(prompt) // 4 + max(1, len(content) // 4),
+        }
+
+        if req.get("stream"):
+            self._stream(model, content, cfg)
+            return
+
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, model, content, cfg):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish=None):
+            payload = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }
+            data = f"data: {json.dumps(payload)}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        for word in content.split(" "):
+            time.sleep(cfg["token_delay"])
+            chunk({"content": word + " "})
+        chunk({}, finish="stop")
+        done = b"data: [DONE]\n\n"
+        self.wfile.write(f"{len(done):x}\r\n".encode() + done + b"\r\n0\r\n\r\n")
+        self.wfile.flush()
+
+
+def start_fake_openai(latency=0.2, jitter=0.05, error_rate=0.0, token_delay=0.01,
+                      host="127.0.0.1", port=0):
+    """Serve the fake API on a daemon thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "token_delay": token_delay,
+        "requests": 0,
+        "errors": 0,
+        "lock": threading.Lock(),
+    }
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean seconds per call")
+    parser.add_argument("--jitter", type=float, default=0.05, help="stddev of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_openai(
+        args.latency, args.jitter, args.error_rate, args.token_delay, args.host, args.port
+    )
+    print(f"fake OpenAI API on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
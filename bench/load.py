@@ -0,0 +1,163 @@
+# ============================================================
+#  Load test: concurrent players against the Flask app, with the
+#  OpenAI API replaced by bench/fake_openai.py.
+#
+#    python bench/load.py --users 32 --games 4 --latency 0.3 --out load.json
+#    python bench/load.py --url http://127.0.0.1:8000 ...   # external server
+#
+#  Each virtual user starts its own game, plays it to MAX_ROUNDS and
+#  chats with the agent every few rounds. Reports throughput and latency
+#  histograms per endpoint.
+# ============================================================
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from common import check_regressions, environment, isolate_event_log, summarize_latencies, write_results
+from fake_openai import start_fake_openai
+
+
+def start_app(base_url):
+    """Serve backend7 in-process (threaded werkzeug) against `base_url`."""
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+    isolate_event_log()
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import backend7
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, backend7.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def post(target, path, payload, recorder):
+    conn = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+    started = time.perf_counter()
+    try:
+        conn.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        body = resp.read()
+        ok = resp.status == 200
+    except OSError:
+        body, ok = b"{}", False
+    finally:
+        conn.close()
+    recorder.add(path, time.perf_counter() - started, ok)
+    return json.loads(body or b"{}") if ok else {}
+
+
+def play(target, games, chat_every, recorder):
+    for _ in range(games):
+        game_id = uuid.uuid4().hex
+        post(target, "/start_simulation", {"game_id": game_id}, recorder)
+        round_idx = 0
+        while True:
+            resp = post(target, "/continue_simulation",
+                        {"game_id": game_id, "strategy": "adaptive", "since_round": round_idx},
+                        recorder)
+            round_idx = resp.get("round", round_idx + 1)
+            if chat_every and round_idx % chat_every == 0:
+                post(target, "/chat_with_agent", {"game_id": game_id, "message": "How is it going?"}, recorder)
+            if resp.get("finished", True):
+                break
+
+
+def run(args):
+    fake = None
+    if args.url:
+        app_url = args.url
+    else:
+        fake, api_url = start_fake_openai(args.latency, args.jitter, args.error_rate)
+        _, app_url = start_app(api_url)
+    target = urlsplit(app_url)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for f in [pool.submit(play, target, args.games, args.chat_every, recorder)
+                  for _ in range(args.users)]:
+            f.result()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        entry = summarize_latencies(latencies)
+        entry["throughput_rps"] = round(len(latencies) / elapsed, 2)
+        entry["errors"] = recorder.errors.get(endpoint, 0)
+        results[endpoint] = entry
+
+    rounds = len(recorder.latencies.get("/continue_simulation", []))
+    conn = http.client.HTTPConnection(target.hostname, target.port, timeout=10)
+    conn.request("GET", "/stats")
+    server_stats = json.loads(conn.getresponse().read() or b"{}")
+    conn.close()
+    return {
+        "environment": environment(),
+        "config": {
+            "users": args.users,
+            "games_per_user": args.games,
+            "chat_every": args.chat_every,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "url": args.url,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "rounds_per_s": round(rounds / elapsed, 2),
+        "upstream_calls": fake.config["requests"] if fake else None,
+        "server_stats": server_stats,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test with a fake OpenAI upstream")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process one")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual players")
+    parser.add_argument("--games", type=int, default=2, help="full games per player")
+    parser.add_argument("--chat-every", type=int, default=3, help="chat every N rounds (0 = never)")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream mean latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier --out file; exit 1 if p99 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run(args)
+    write_results(results, args.out)
+
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "p99_ms", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
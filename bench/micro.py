@@ -0,0 +1,88 @@
+# ============================================================
+#  Micro-benchmarks for the per-round hot path (no network).
+#
+#    python bench/micro.py --out micro.json
+#    python bench/micro.py --baseline micro.json   # exit 1 on >15% slowdown
+# ============================================================
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+from common import check_regressions, environment, isolate_event_log, write_results
+
+isolate_event_log()
+os.environ.setdefault("OPENAI_API_KEY", "bench-fake-key")
+import backend7  # noqa: E402
+
+
+def sample_state(rounds):
+    """A mid-game state with `rounds` played rounds, built without the advisor."""
+    random.seed(7)
+    state = backend7.new_game_state()
+    for _ in range(rounds):
+        am = backend7.balanced_strategy(state)
+        mc = backend7.decide_mc_investment(state)
+        am_pay, mc_pay = backend7.compute_payoff(am, mc)
+        entry = {
+            "round": state["round"] + 1,
+            "am": am,
+            "mc": mc,
+            "am_pay": am_pay,
+            "mc_pay": mc_pay,
+            "am_reasoning": backend7.generate_reasoning(am, "balanced", 12, state),
+        }
+        backend7.commit_round(state, entry)
+    return state
+
+
+def bench(fn, repeat):
+    """Best-of-`repeat` nanoseconds per call, auto-ranging the loop count."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"ns_per_op": round(best * 1e9, 1), "loops": number}
+
+
+def run(repeat, history_rounds):
+    state = sample_state(history_rounds)
+    cases = {
+        "compute_payoff": lambda: backend7.compute_payoff(13, 12),
+        "generate_reasoning": lambda: backend7.generate_reasoning(14, "adaptive", 12, state),
+        "history_json": lambda: json.dumps(state["history"]),
+        "history_jsonify": lambda: backend7.app.json.dumps(state["history"]),
+    }
+    for name in backend7.PERSONA_PROFILES:
+        cases[f"strategy_pick[{name}]"] = lambda name=name: backend7.strategy_pick(name, state)
+
+    return {
+        "environment": environment(),
+        "history_rounds": history_rounds,
+        "results": {name: bench(fn, repeat) for name, fn in cases.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hot-path micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--history-rounds", type=int, default=backend7.MAX_ROUNDS)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.history_rounds)
+    write_results(results, args.out)
+
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "ns_per_op", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# ============================================================
+#  Startup benchmark: how long a fresh interpreter takes to import
+#  backend7 and serve its first request, with the payoff asset cold
+#  (rebuilt from payoff_tables.py) and warm (memory-mapped).
+#
+#    python bench/startup.py --runs 10 --out startup.json
+# ============================================================
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, check_regressions, environment, summarize_latencies, write_results
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import backend7
+t1 = time.perf_counter()
+backend7.app.test_client().get("/")
+t2 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "first_request": t2 - t0}))
+"""
+
+
+def probe(env):
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True,
+        capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(runs):
+    base_env = dict(os.environ)
+    base_env.pop("OPENAI_API_KEY", None)  # startup must not need credentials
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        asset = os.path.join(tmp, "payoff_tables.b7")
+        env = dict(base_env, PAYOFF_ASSET_PATH=asset)
+        probe(env)  # warm the .pyc files so both cases measure the same thing
+
+        cold = []
+        for _ in range(runs):
+            if os.path.exists(asset):
+                os.remove(asset)
+            cold.append(probe(env))
+        warm = [probe(env) for _ in range(runs)]
+
+    for label, samples in (("cold_asset", cold), ("warm_asset", warm)):
+        for phase in ("import", "first_request"):
+            results[f"{label}.{phase}"] = summarize_latencies([s[phase] for s in samples])
+    return {"environment": environment(), "runs": runs, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="backend7 cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="earlier --out file; exit 1 if p50 regressed")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    write_results(results, args.out)
+
+    if args.baseline:
+        regressions = check_regressions(results, args.baseline, "p50_ms", args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# ============================================================
+#  gunicorn settings (Procfile: web: gunicorn -c gunicorn.conf.py backend7:app)
+#  GUNICORN_WORKER_CLASS=gevent -> async worker, hundreds of rounds in flight
+#  per worker while they wait on the LLM; gthread is the default.
+#  GUNICORN_PRELOAD=1 (default) imports the app once in the master, so new
+#  workers are plain forks that share the mapped payoff tables.
+# ============================================================
+
+import os
+
+bind = "0.0.0.0:" + os.environ.get("PORT", "8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+
+if preload_app and worker_class == "gevent":
+    # the app is imported in the master, so patch before it loads threading/ssl
+    from gevent import monkey
+
+    monkey.patch_all()
+
+
+def post_fork(server, worker):
+    # replay the event log in each worker, not in the preloaded master: a worker
+    # respawned later must rebuild from the log as it is now, not a boot snapshot.
+    # Without --preload the worker's first request does it (backend7.replay_once).
+    if preload_app:
+        import backend7  # already imported by the master
+
+        backend7.replay_once()
@@ -0,0 +1,221 @@
+# ============================================================
+#  STRATEGY TOURNAMENT — every AM strategy × every MC policy ×
+#  every blend weight × every game length, headless (no LLM).
+#
+#    python tournament.py --games 1000000 --weights 0.4,0.6,0.8 \
+#        --rounds 10,50 --out results.csv
+#
+#  Each cell is split into fixed-size shards run on a process pool.
+#  Shard seeds come from SeedSequence(seed, cell, shard), so the output
+#  is identical for any --workers value. One row per shard is streamed
+#  to CSV (or Parquet, if the path ends in .parquet and pyarrow is
+#  installed); a per-cell summary is printed at the end.
+# ============================================================
+
+from itertools import product
+from multiprocessing import Pool
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import backend7
+
+ROW_FIELDS = [
+    "am_strategy", "mc_policy", "strategy_weight", "rounds", "advisor", "shard", "seed",
+    "n_games", "am_mean", "am_std", "am_p5", "am_p50", "am_p95",
+    "mc_mean", "mc_std", "am_win_rate", "mc_win_rate", "tie_rate",
+    "am_mean_move", "mc_mean_move",
+]
+
+
+def shard_seed(seed, cell_idx, shard_idx):
+    return int(np.random.SeedSequence([seed, cell_idx, shard_idx]).generate_state(1)[0])
+
+
+def plan(args):
+    """(cell_idx, shard_idx, params) for every shard, in a fixed order."""
+    cells = list(product(args.strategies, args.mc_policies, args.weights, args.rounds))
+    n_shards = -(-args.games // args.shard_games)
+    for cell_idx, (strategy, mc_policy, weight, rounds) in enumerate(cells):
+        for shard_idx in range(n_shards):
+            n = min(args.shard_games, args.games - shard_idx * args.shard_games)
+            yield {
+                "strategy": strategy,
+                "mc_policy": mc_policy,
+                "strategy_weight": weight,
+                "rounds": rounds,
+                "advisor": args.advisor,
+                "n_games": n,
+                "shard": shard_idx,
+                "seed": shard_seed(args.seed, cell_idx, shard_idx),
+            }
+
+
+def run_shard(task):
+    r = backend7.batch_simulate(
+        task["strategy"], task["n_games"], task["rounds"], task["seed"],
+        task["advisor"], task["strategy_weight"], task["mc_policy"],
+    )
+    return {
+        "am_strategy": task["strategy"],
+        "mc_policy": task["mc_policy"],
+        "strategy_weight": task["strategy_weight"],
+        "rounds": task["rounds"],
+        "advisor": task["advisor"],
+        "shard": task["shard"],
+        "seed": task["seed"],
+        "n_games": r["n_games"],
+        "am_mean": r["am_total"]["mean"],
+        "am_std": r["am_total"]["std"],
+        "am_p5": r["am_total"]["p5"],
+        "am_p50": r["am_total"]["p50"],
+        "am_p95": r["am_total"]["p95"],
+        "mc_mean": r["mc_total"]["mean"],
+        "mc_std": r["mc_total"]["std"],
+        "am_win_rate": r["am_win_rate"],
+        "mc_win_rate": r["mc_win_rate"],
+        "tie_rate": r["tie_rate"],
+        "am_mean_move": r["am_mean_move"],
+        "mc_mean_move": r["mc_mean_move"],
+    }
+
+
+class CsvSink:
+    def __init__(self, path):
+        self._file = open(path, "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=ROW_FIELDS)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """Buffers rows into row groups of `batch` rows. Needs pyarrow."""
+
+    def __init__(self, path, batch=1024):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("writing .parquet needs pyarrow (pip install pyarrow); use a .csv path instead")
+        self._pa = pa
+        self._schema = pa.schema([
+            (name, pa.string() if name in ("am_strategy", "mc_policy", "advisor")
+             else pa.int64() if name in ("rounds", "shard", "seed", "n_games")
+             else pa.float64())
+            for name in ROW_FIELDS
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows = []
+        self._batch = batch
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self._batch:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def summarize(rows):
+    """Exact per-cell mean, pooled std and win rates from shard rows."""
+    cells = {}
+    for row in rows:
+        key = (row["am_strategy"], row["mc_policy"], row["strategy_weight"], row["rounds"])
+        cells.setdefault(key, []).append(row)
+
+    summary = []
+    for (strategy, mc_policy, weight, rounds), shards in cells.items():
+        n = np.array([s["n_games"] for s in shards], dtype=np.float64)
+        total = n.sum()
+
+        def pooled(prefix):
+            means = np.array([s[f"{prefix}_mean"] for s in shards])
+            stds = np.array([s[f"{prefix}_std"] for s in shards])
+            mean = (n * means).sum() / total
+            var = (n * (stds ** 2 + (means - mean) ** 2)).sum() / total
+            return mean, float(np.sqrt(var))
+
+        am_mean, am_std = pooled("am")
+        mc_mean, mc_std = pooled("mc")
+        summary.append({
+            "am_strategy": strategy,
+            "mc_policy": mc_policy,
+            "strategy_weight": weight,
+            "rounds": rounds,
+            "n_games": int(total),
+            "am_mean": round(am_mean, 3),
+            "am_std": round(am_std, 3),
+            "mc_mean": round(mc_mean, 3),
+            "mc_std": round(mc_std, 3),
+            "am_win_rate": round(float((n * [s["am_win_rate"] for s in shards]).sum() / total), 6),
+            "tie_rate": round(float((n * [s["tie_rate"] for s in shards]).sum() / total), 6),
+        })
+    return summary
+
+
+def csv_list(cast):
+    return lambda text: [cast(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="round-robin strategy tournament")
+    parser.add_argument("--strategies", type=csv_list(str), default=list(backend7.AM_STRATEGIES))
+    parser.add_argument("--mc-policies", type=csv_list(str), default=list(backend7.BATCH_MC_POLICIES))
+    parser.add_argument("--weights", type=csv_list(float), default=[backend7.STRATEGY_WEIGHT],
+                        help="strategy blend weights to sweep (only matter with --advisor stub)")
+    parser.add_argument("--rounds", type=csv_list(int), default=[backend7.MAX_ROUNDS],
+                        help="game lengths to sweep")
+    parser.add_argument("--advisor", choices=backend7.BATCH_ADVISORS, default="stub")
+    parser.add_argument("--games", type=int, default=100_000, help="games per cell")
+    parser.add_argument("--shard-games", type=int, default=50_000, help="games per shard")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--out", default="tournament.csv", help=".csv or .parquet")
+    args = parser.parse_args()
+
+    for name in args.strategies:
+        if name not in backend7.AM_STRATEGIES:
+            parser.error(f"unknown strategy {name!r}")
+    for name in args.mc_policies:
+        if name not in backend7.BATCH_MC_POLICIES:
+            parser.error(f"unknown MC policy {name!r}")
+
+    sink = ParquetSink(args.out) if args.out.endswith(".parquet") else CsvSink(args.out)
+    started = time.perf_counter()
+    rows = []
+    try:
+        with Pool(args.workers) as pool:
+            # imap keeps plan order, so the file is the same for any --workers
+            for row in pool.imap(run_shard, plan(args)):
+                sink.write(row)
+                rows.append(row)
+    finally:
+        sink.close()
+
+    print(json.dumps({
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "shards": len(rows),
+        "out": args.out,
+        "cells": summarize(rows),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()